@@ -0,0 +1,28 @@
+import argparse
+from lib import batch
+
+
+def address_range(text):
+    start, end = text.split(':')
+    return int(start, 16), int(end, 16)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source_files', nargs='+')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--limit', type=int, metavar='CYCLES', help='stop each program after CYCLES cycles')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS', help='stop each program after SECONDS seconds')
+    parser.add_argument('--dump', type=address_range, action='append', default=[], metavar='START:END',
+                        help='print memory from START to END (hex, END exclusive)')
+    parser.add_argument('--no-cache', action='store_true', help='always reassemble instead of using the assembly cache')
+    args = parser.parse_args()
+
+    jobs = [batch.Job(open(source_file, 'r').read(), source_file, limit=args.limit, timeout=args.timeout,
+                      ranges=args.dump, cache=not args.no_cache) for source_file in args.source_files]
+
+    for result in batch.run_batch(jobs, args.workers):
+        print('%s: %s cycles=%d %s' % (result.name, result.status, result.cycles,
+                                       ' '.join('%s=%02x' % item for item in result.registers.items())))
+        for (start, end), data in result.memory.items():
+            print('  %04x: %s' % (start, data.hex()))
@@ -1,3 +1,9 @@
+import bisect
+import io
+import itertools
+import operator
+import re
+
 from lib import ops
 
 
@@ -5,40 +11,284 @@ class Assembler:
 
     def __init__(self):
         self.labels = {}
-        self.relatives = []
-        self.absolutes = []
-        self.lines = {}
+        self.references = {}
+        self.definitions = {}
+        self.parsed = {}
+        self.texts = []
+        self.units = []
+        self.start_address = 0x0600
+        self.dump = []
+        self._lines = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = {}
+            for unit in self.units or []:
+                for offset, line in self.parsed[unit.key][3]:
+                    self._lines[unit.pc + offset] = unit.line + line
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        self._lines = lines
 
     def assemble(self, program, start_address = 0x0600):
-        lexer = Lexer(program)
+        try:
+            dump = self.layout(program, start_address)
+            for label, references in self.references.items():
+                address = self.labels[label]
+                for unit, offset, relative in references:
+                    pc = unit.pc + offset
+                    self.fix(dump, pc - start_address, pc, address, relative)
+        except Exception:
+            self.units = None
+            raise
+
+        self.dump = dump
+        return dump
+
+    def compile(self, program):
+        dump = self.layout(program, 0)
+        fixups = []
+        for label, references in self.references.items():
+            for unit, offset, relative in references:
+                pc = unit.pc + offset
+                if relative and label in self.labels:
+                    self.fix(dump, pc, pc, self.labels[label], relative)
+                else:
+                    fixups.append((pc, relative, label))
+
+        self.units = None
+        return Object(dump, self.labels, sorted(fixups), self.lines)
+
+    def layout(self, program, start_address):
+        self.start_address = start_address
+        self.labels, self.references, self.definitions = {}, {}, {}
+        self.texts, self.units = [], []
+        self._lines = None
+
         dump = []
-        while lexer.has_next():
-            pc = start_address + len(dump)
-            op = lexer.next()
-            self.lines[pc] = lexer.line
+        key = ()
+        for text in Lexer.lines(program):
+            self.texts.append(text)
+            key += (text,)
+            unit = Unit(key, start_address + len(dump), len(self.texts) - len(key))
+            parsed = self.parse(unit)
+            if parsed is not None:
+                if parsed[3]:
+                    dump += self.add(unit)
+                key = ()
+
+        if key:
+            self.parse(unit, True)
+        self._lines = None
+        return dump
+
+    def parse(self, unit, final=False):
+        parsed = self.parsed.get(unit.key)
+        if parsed is None:
+            parsed = self.parse_unit(unit, final)
+            if parsed is not None and parsed[3]:
+                self.parsed[unit.key] = parsed
+        return parsed
 
+    def parse_unit(self, unit, final):
+        tokens = iter([(token, line) for line, text in enumerate(unit.key) for token in Lexer.tokens(text)])
+        code, labels, fixups, lines = [], [], [], []
+
+        for op, line in tokens:
+            lines.append((len(code), line))
+            if op[-1] == ':':
+                labels.append((len(code), op[:-1]))
+                continue
+            elif (op, None) in ops.op_codes:
+                code.append(ops.op_codes[(op, None)])
+                continue
+
+            arg, line = next(tokens, (None, line))
+            if arg is None and not final:
+                return None
             try:
-                dump += self.get_op_codes(lexer, op, pc)
+                op_codes = self.op_with_arg(op, arg)
             except Exception:
-                raise Exception('Error in line ' + str(lexer.line) + ' [' + op + ']')
+                raise Exception('Error in line ' + str(unit.line + line) + ' [' + op + ']')
 
-        for pc in self.relatives:
-            dump[pc - start_address] = self._signed(self.labels[dump[pc - start_address]] - pc - 1)
-        for pc in self.absolutes:
-            dump[pc - start_address] = self.labels[dump[pc - start_address]] % 0x100
-            dump[pc - start_address + 1] = int(self.labels[dump[pc - start_address + 1]] / 0x100)
-        return dump
+            if isinstance(op_codes[-1], str):
+                relative = len(op_codes) == 2
+                fixups.append((len(code) + 1, relative, op_codes[-1]))
+                op_codes = [op_codes[0]] + [0] * (len(op_codes) - 1)
+            code += op_codes
+        return tuple(code), tuple(labels), tuple(fixups), tuple(lines)
 
-    def get_op_codes(self, lexer, op, pc):
-        if op[-1] == ':':
-            self.labels[op[:-1]] = pc
-            return []
-        elif op in ops.mnemonics:
-            return [ops.op_codes[(op, None)]]
+    def add(self, unit):
+        code, labels, fixups, lines = self.parsed[unit.key]
+        self.units.append(unit)
+        for offset, label in labels:
+            self.labels[label] = unit.pc + offset
+            self.definitions.setdefault(label, []).append((unit, offset))
+        for offset, relative, label in fixups:
+            self.references.setdefault(label, []).append((unit, offset, relative))
+        return code
+
+    def remove(self, unit):
+        code, labels, fixups, lines = self.parsed[unit.key]
+        for offset, label in labels:
+            self.definitions[label].remove((unit, offset))
+        for offset, relative, label in fixups:
+            self.references[label].remove((unit, offset, relative))
+
+    @classmethod
+    def fix(cls, dump, offset, pc, address, relative):
+        if relative:
+            dump[offset] = cls._signed(address - pc - 1)
         else:
-            return self.op_with_arg(op, lexer.next(), pc)
+            dump[offset] = address % 0x100
+            dump[offset + 1] = int(address / 0x100)
 
-    def op_with_arg(self, op, arg, pc):
+    def reassemble(self, program):
+        previous = self.dump
+        if self.units is None:
+            return self.difference(previous, self.assemble(program, self.start_address), 0)
+
+        texts = list(Lexer.lines(program))
+        first, last = self.changed(self.texts, texts)
+        if first == len(texts) == len(self.texts):
+            return []
+
+        begin, end, added, code = self.relayout(texts, first, last)
+        try:
+            return self.splice(texts, begin, end, added, code)
+        except Exception:
+            self.units = None
+            raise
+
+    @staticmethod
+    def changed(old, new, step=0x100):
+        limit = min(len(old), len(new))
+        first = 0
+        while first + step <= limit and old[first:first + step] == new[first:first + step]:
+            first += step
+        while first < limit and old[first] == new[first]:
+            first += 1
+
+        last = 0
+        while last + step <= limit - first and \
+                old[len(old) - last - step:len(old) - last] == new[len(new) - last - step:len(new) - last]:
+            last += step
+        while last < limit - first and old[-1 - last] == new[-1 - last]:
+            last += 1
+        return first, last
+
+    def relayout(self, texts, first, last):
+        units, shift = self.units, len(texts) - len(self.texts)
+        begin = max(0, bisect.bisect_right(units, first, key=lambda unit: unit.line) - 1)
+        end = bisect.bisect_left(units, len(self.texts) - last, key=lambda unit: unit.line)
+
+        start = units[begin].pc if begin < len(units) else self.start_address + len(self.dump)
+        added, code, pending = [], [], []
+        line = min(units[begin].line, first) if begin < len(units) else first
+        while True:
+            stop = (units[end].line if end < len(units) else len(self.texts)) + shift
+            while line < stop:
+                pending.append(texts[line])
+                line += 1
+                unit = Unit(tuple(pending), start + len(code), line - len(pending))
+                parsed = self.parse(unit, line == len(texts))
+                if parsed is not None:
+                    if parsed[3]:
+                        added.append(unit)
+                        code += parsed[0]
+                    pending = []
+            if not pending:
+                break
+            end += 1
+        return begin, end, added, code
+
+    def splice(self, texts, begin, end, added, added_code):
+        units, previous, start_address = self.units, self.dump, self.start_address
+        shift = len(texts) - len(self.texts)
+        start = units[begin].pc if begin < len(units) else start_address + len(previous)
+        finish = units[end].pc if end < len(units) else start_address + len(previous)
+        delta = start + len(added_code) - finish
+
+        moved = {}
+        for unit in units[begin:end] + added:
+            for offset, label in self.parsed[unit.key][1]:
+                moved[label] = self.labels.get(label)
+        for unit in units[begin:end]:
+            self.remove(unit)
+
+        fixes = []
+        if shift:
+            for unit in units[end:]:
+                unit.line += shift
+        if delta:
+            for unit in units[end:]:
+                unit.pc += delta
+                code, labels, fixups, lines = self.parsed[unit.key]
+                for offset, label in labels:
+                    moved.setdefault(label, self.labels.get(label))
+                for offset, relative, label in fixups:
+                    if relative:
+                        fixes.append((unit, offset, relative, label))
+
+        self.units = units[:begin]
+        for unit in added:
+            self.add(unit)
+            fixes += [(unit, offset, relative, label) for offset, relative, label in self.parsed[unit.key][2]]
+        self.units += units[end:]
+        self.texts = texts
+        self._lines = None
+
+        for label, address in moved.items():
+            definitions = self.definitions.get(label)
+            if definitions:
+                self.labels[label] = max(unit.pc + offset for unit, offset in definitions)
+            else:
+                self.labels.pop(label, None)
+            if self.labels.get(label) != address:
+                fixes += [(unit, offset, relative, label) for unit, offset, relative in self.references.get(label, ())]
+
+        dump = previous[:start - start_address] + added_code + previous[finish - start_address:]
+        positions = set() if delta else set(range(start - start_address, start + len(added_code) - start_address))
+        for unit, offset, relative, label in fixes:
+            pc = unit.pc + offset
+            self.fix(dump, pc - start_address, pc, self.labels[label], relative)
+            if pc < start or not delta:
+                positions.update(range(pc - start_address, pc - start_address + (1 if relative else 2)))
+
+        self.dump = dump
+        patches = self.changes(previous, dump, sorted(positions))
+        return patches + self.difference(previous, dump, start - start_address) if delta else patches
+
+    def difference(self, previous, dump, first):
+        last = max(len(previous), len(dump))
+        previous = previous + [0] * (last - len(previous))
+        dump = dump + [0] * (last - len(dump))
+        while first < last and previous[first] == dump[first]:
+            first += 1
+        while last > first and previous[last - 1] == dump[last - 1]:
+            last -= 1
+        return [(self.start_address + first, bytes(dump[first:last]))] if first < last else []
+
+    def changes(self, previous, dump, positions):
+        patches = []
+        run = []
+        for position in positions:
+            before = previous[position] if position < len(previous) else 0
+            after = dump[position] if position < len(dump) else 0
+            if before == after:
+                continue
+            if run and run[-1][0] != position - 1:
+                patches.append((self.start_address + run[0][0], bytes(value for _, value in run)))
+                run = []
+            run.append((position, after))
+        if run:
+            patches.append((self.start_address + run[0][0], bytes(value for _, value in run)))
+        return patches
+
+    def op_with_arg(self, op, arg):
         mode = None
         if arg[0] == '#':
             if arg[1] == '$':
@@ -74,11 +324,9 @@ class Assembler:
         else:
             if op in ['jmp', 'jsr']:
                 mode = 'ab'
-                self.absolutes.append(pc + 1)
                 args = [arg, arg]
             else:
                 mode = 'im'
-                self.relatives.append(pc + 1)
                 args = [arg]
 
         return [ops.op_codes[(op, mode)]] + args
@@ -88,44 +336,38 @@ class Assembler:
         return a if a > 0 else 0xff + a + 1
 
 
+class Object:
+    def __init__(self, code, labels, fixups, lines):
+        self.code = list(code)
+        self.labels = dict(labels)
+        self.fixups = list(fixups)
+        self.lines = dict(lines)
+
+
+class Unit:
+    __slots__ = ['key', 'pc', 'line']
+
+    def __init__(self, key, pc, line):
+        self.key = key
+        self.pc = pc
+        self.line = line
+
+
 class Lexer:
+    token = re.compile(r'[^ \t\n]+')
+
+    @staticmethod
+    def lines(program):
+        if isinstance(program, str):
+            program = io.StringIO(program)
+
+        return map(operator.methodcaller('rstrip', '\n'), itertools.dropwhile(lambda text: not text.strip(), program))
 
-    def __init__(self, program):
-        self.program = program.strip().lower()
-        self.position = 0
-        self.line = 0
-        self.buffer = None
-
-    def has_next(self):
-        if not self.buffer:
-            self.buffer = self._parse_next_token()
-        return not not self.buffer
-
-    def next(self):
-        if not self.buffer:
-            self.buffer = self._parse_next_token()
-
-        token = self.buffer
-        self.buffer = None
-        return token
-
-    def _parse_next_token(self):
-        white_space = ' \t\n'
-
-        while self.position < len(self.program):
-            c = self.program[self.position]
-            if c == ';':
-                self._until('\n')
-                self.line += 1
-            elif c not in white_space:
-                return self._until(white_space)
-            if c == "\n":
-                self.line += 1
-            self.position += 1
-
-    def _until(self, chars):
-        token = ''
-        while self.position < len(self.program) and self.program[self.position] not in chars:
-            token += self.program[self.position]
-            self.position += 1
-        return token
\ No newline at end of file
+    @classmethod
+    def tokens(cls, text):
+        tokens = cls.token.findall(text.lower())
+        if ';' in text:
+            for position, token in enumerate(tokens):
+                if token[0] == ';':
+                    return tokens[:position]
+        return tokens
\ No newline at end of file
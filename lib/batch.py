@@ -0,0 +1,86 @@
+import concurrent.futures
+import time
+
+from lib import assembler, cache, controller, ops
+
+controllers = {}
+
+
+class Job:
+    def __init__(self, source, name=None, start=0x0600, limit=None, timeout=None, ranges=(), mem_size=0x10000,
+                 operations=ops.Operations, cache=False):
+        self.source = source
+        self.name = name
+        self.start = start
+        self.limit = limit
+        self.timeout = timeout
+        self.ranges = list(ranges)
+        self.mem_size = mem_size
+        self.operations = operations
+        self.cache = cache
+
+
+class Result:
+    def __init__(self, job, status, c):
+        self.name = job.name
+        self.status = status
+        self.cycles = c.cycles
+        self.registers = {'pc': c.pc, 'sp': c.sp, 'a': c.a, 'x': c.x, 'y': c.y, 'p': c.p}
+        self.memory = dict(((start, end), bytes(c.mem[start:end])) for start, end in job.ranges)
+
+
+def fresh(mem_size, operations):
+    key = (mem_size, operations)
+    if key not in controllers:
+        c = controller.Controller(mem_size, operations=operations)
+        controllers[key] = (c, c.snapshot())
+
+    c, clean = controllers[key]
+    c.restore(clean)
+    return c
+
+
+def run(c, limit=None, timeout=None, slice=0x10000):
+    until = float('inf') if limit is None else limit
+    deadline = None if timeout is None else time.perf_counter() + timeout
+
+    while c.ops.run(min(c.cycles + slice, until)):
+        if c.cycles >= until:
+            return 'limit'
+        if deadline is not None and time.perf_counter() > deadline:
+            return 'timeout'
+    return 'done'
+
+
+def execute(job):
+    c = fresh(job.mem_size, job.operations)
+    c.pc = job.start
+    try:
+        asm = cache.CachedAssembler() if job.cache else assembler.Assembler()
+        c.load(asm.assemble(job.source, job.start), job.start)
+        status = run(c, job.limit, job.timeout)
+    except Exception as e:
+        status = 'error: %s' % e
+    return Result(job, status, c)
+
+
+class BatchRunner:
+    def __init__(self, workers=None):
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+
+    def run(self, jobs, chunksize=1):
+        return list(self.executor.map(execute, jobs, chunksize=chunksize))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_batch(jobs, workers=None):
+    with BatchRunner(workers) as runner:
+        return runner.run(jobs)
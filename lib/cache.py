@@ -0,0 +1,216 @@
+import hashlib
+import io
+import os
+import struct
+import tempfile
+from array import array
+
+from lib import assembler, ops
+
+magic = b'A65C'
+header = struct.Struct('<4sHIII')
+object_magic = b'O65C'
+object_header = struct.Struct('<4sIIII')
+
+
+def fingerprint(modules):
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+version = fingerprint([assembler, ops])
+
+
+def default_directory():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), '6502')
+
+
+def pack(dump, labels, lines, start_address):
+    names = '\n'.join(labels).encode()
+    addresses = array('I', labels.values())
+    line_map = array('I', [number for pair in sorted(lines.items()) for number in pair])
+    return (header.pack(magic, start_address, len(dump), len(labels), len(lines)) +
+            bytes(dump) + addresses.tobytes() + line_map.tobytes() + names)
+
+
+def unpack(data):
+    tag, start_address, dump_size, label_count, line_count = header.unpack_from(data)
+    if tag != magic:
+        raise ValueError('Not an assembly cache entry')
+
+    position = header.size
+    dump = list(data[position:position + dump_size])
+    position += dump_size
+
+    addresses = array('I')
+    addresses.frombytes(data[position:position + label_count * addresses.itemsize])
+    position += label_count * addresses.itemsize
+
+    line_map = array('I')
+    line_map.frombytes(data[position:position + line_count * 2 * line_map.itemsize])
+    position += line_count * 2 * line_map.itemsize
+
+    names = data[position:].decode().split('\n') if label_count else []
+    labels = dict(zip(names, addresses))
+    lines = dict(zip(line_map[0::2], line_map[1::2]))
+    return dump, labels, lines
+
+
+def pack_object(obj):
+    names = '\n'.join(list(obj.labels) + [label for _, _, label in obj.fixups]).encode()
+    addresses = array('I', obj.labels.values())
+    offsets = array('I', [offset for offset, _, _ in obj.fixups])
+    kinds = bytes(relative for _, relative, _ in obj.fixups)
+    line_map = array('I', [number for pair in sorted(obj.lines.items()) for number in pair])
+    return (object_header.pack(object_magic, len(obj.code), len(obj.labels), len(obj.fixups), len(obj.lines)) +
+            bytes(obj.code) + addresses.tobytes() + offsets.tobytes() + kinds + line_map.tobytes() + names)
+
+
+def unpack_object(data):
+    tag, code_size, label_count, fixup_count, line_count = object_header.unpack_from(data)
+    if tag != object_magic:
+        raise ValueError('Not an object cache entry')
+
+    position = object_header.size
+    code = list(data[position:position + code_size])
+    position += code_size
+
+    arrays = []
+    for count in [label_count, fixup_count]:
+        numbers = array('I')
+        numbers.frombytes(data[position:position + count * numbers.itemsize])
+        position += count * numbers.itemsize
+        arrays.append(numbers)
+    addresses, offsets = arrays
+
+    kinds = [kind == 1 for kind in data[position:position + fixup_count]]
+    position += fixup_count
+
+    line_map = array('I')
+    line_map.frombytes(data[position:position + line_count * 2 * line_map.itemsize])
+    position += line_count * 2 * line_map.itemsize
+
+    names = data[position:].decode().split('\n') if label_count + fixup_count else []
+    labels = dict(zip(names[:label_count], addresses))
+    fixups = list(zip(offsets, kinds, names[label_count:]))
+    lines = dict(zip(line_map[0::2], line_map[1::2]))
+    return assembler.Object(code, labels, fixups, lines)
+
+
+class CachedAssembler(assembler.Assembler):
+    def __init__(self, directory=None, max_size=0x1000000):
+        super().__init__()
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.hit = False
+
+    def key(self, program, start_address):
+        position = None if isinstance(program, str) else program.tell()
+        digest = self.digest(start_address)
+        for _ in self.hashed(program, digest):
+            pass
+        if position is not None:
+            program.seek(position)
+        return digest.hexdigest()
+
+    @staticmethod
+    def digest(start_address):
+        digest = hashlib.sha256(version)
+        digest.update(b'object' if start_address is None else struct.pack('<H', start_address))
+        return digest
+
+    @staticmethod
+    def hashed(program, digest):
+        for line in io.StringIO(program) if isinstance(program, str) else program:
+            digest.update(line.rstrip('\n').encode() + b'\n')
+            yield line
+
+    @staticmethod
+    def rewindable(program):
+        return isinstance(program, str) or getattr(program, 'seekable', lambda: False)()
+
+    def load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def save(self, path, data):
+        try:
+            self.store(path, data())
+        except (OSError, ValueError, OverflowError):
+            pass
+
+    def assemble(self, program, start_address=0x0600):
+        self.hit = False
+        digest = self.digest(start_address)
+        if self.rewindable(program):
+            path = os.path.join(self.directory, self.key(program, start_address) + '.bin')
+            data = self.load(path)
+            try:
+                if data is not None:
+                    dump, self.labels, self.lines = unpack(data)
+                    self.start_address, self.dump, self.hit = start_address, dump, True
+                    self.units = None
+                    return dump
+            except (ValueError, struct.error):
+                pass
+        else:
+            program = self.hashed(program, digest)
+            path = None
+
+        dump = super().assemble(program, start_address)
+        path = path or os.path.join(self.directory, digest.hexdigest() + '.bin')
+        self.save(path, lambda: pack(dump, self.labels, self.lines, start_address))
+        return dump
+
+    def compile(self, program):
+        self.hit = False
+        digest = self.digest(None)
+        if self.rewindable(program):
+            path = os.path.join(self.directory, self.key(program, None) + '.obj')
+            data = self.load(path)
+            try:
+                if data is not None:
+                    obj = unpack_object(data)
+                    self.labels, self.lines, self.hit = obj.labels, obj.lines, True
+                    self.units = None
+                    return obj
+            except (ValueError, struct.error):
+                pass
+        else:
+            program = self.hashed(program, digest)
+            path = None
+
+        obj = super().compile(program)
+        path = path or os.path.join(self.directory, digest.hexdigest() + '.obj')
+        self.save(path, lambda: pack_object(obj))
+        return obj
+
+    def store(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(('.bin', '.obj')):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
@@ -1,14 +1,76 @@
 from lib import ops
+from lib.governor import Governor
+from lib.loops import LoopDetector
+from lib.scheduler import Scheduler
+
+
+class Page:
+    def __init__(self, controller):
+        self.c = controller
+        self.devices = {}
+
+    def read(self, where):
+        device = self.devices.get(where)
+        if device is None:
+            return self.c.mem[where]
+        return device.read(where)
+
+    def write(self, what, where):
+        device = self.devices.get(where)
+        if device is None:
+            self.c.mem[where] = what
+        else:
+            device.write(what, where)
+
+
+class DirtyPages:
+    def __init__(self, controller):
+        self.c = controller
+        self.dirty = set()
+        self.trapped = {}
+
+    def trap(self):
+        for page in range((len(self.c.mem) + 0xff) >> 8):
+            self.trapped[page] = self.c.writers[page]
+            self.c.writers[page] = self
+
+    def write(self, what, where):
+        self.dirty.add(where >> 8)
+        device = self.trapped[where >> 8]
+        if device is None:
+            self.c.mem[where] = what
+        else:
+            device.write(what, where)
+
+
+class Snapshot:
+    def __init__(self, pages, registers):
+        self.pages = pages
+        self.registers = registers
+
+
+registers = ['pc', 'sp', 'a', 'x', 'y', 'nz', 'v', 'u', 'b', 'd', 'i', 'c', 'cycles', 'pending_irq', 'pending_nmi']
 
 
 class Controller:
-    def __init__(self, mem_size=0xFFFF, pc=0x0600, stack_top=0x0100):
-        self.ops = ops.Operations(self)
+    def __init__(self, mem_size=0x10000, pc=0x0600, stack_top=0x0100, operations=ops.Operations, clock=None):
+        self.loops = LoopDetector(self)
+        self.ops = operations(self)
+        self.governor = Governor(clock)
+        self.scheduler = Scheduler(self.bound)
 
-        self.vmem = {}
-        self.mem = [0 for i in range(0, mem_size)]
+        self.readers = [None] * 0x100
+        self.writers = [None] * 0x100
+        self.mem = bytearray(mem_size)
+        self.memory = memoryview(self.mem)
+        self.pages = None
+        self.dirty_pages = DirtyPages(self)
 
         self.stack_top = stack_top
+        self.cycles = 0
+        self.pending_irq = False
+        self.pending_nmi = False
+        self.on_return = None
 
         # Registers
         self.pc = pc # Programm Counter
@@ -18,44 +80,194 @@ class Controller:
         self.y = 0 # Y
 
         # Flags
-        self.n = False # Negative
+        self.nz = 1 # Last result, Negative and Zero are derived from it
         self.v = False # Overflow
         self.u = True # Unused
         self.b = False # Break
         self.d = False # Decimal Mode
-        self.i = False # Interrupt Disable
-        self.z = False # Zero
+        self.interrupt_disable = False # Interrupt Disable
         self.c = False # Carry
 
+    @property
+    def n(self):
+        return self.nz & 0x180 != 0
+
+    @n.setter
+    def n(self, value):
+        self.nz = ops.nz_of(value, self.z)
+
+    @property
+    def z(self):
+        return self.nz & 0xff == 0
+
+    @z.setter
+    def z(self, value):
+        self.nz = ops.nz_of(self.n, value)
+
+    @property
+    def i(self):
+        return self.interrupt_disable
+
+    @i.setter
+    def i(self, value):
+        self.interrupt_disable = value
+        if not value and self.pending_irq:
+            self.bound(self.cycles)
+
+    @property
+    def p(self):
+        return (ops.nz_flags[self.nz] |
+                (ops.OVERFLOW if self.v else 0) |
+                (ops.UNUSED if self.u else 0) |
+                (ops.BREAK if self.b else 0) |
+                (ops.DECIMAL if self.d else 0) |
+                (ops.INTERRUPT if self.i else 0) |
+                (ops.CARRY if self.c else 0))
+
+    @p.setter
+    def p(self, value):
+        self.nz = ops.nz_of(value & ops.NEGATIVE, value & ops.ZERO)
+        self.v = value & ops.OVERFLOW != 0
+        self.u = value & ops.UNUSED != 0
+        self.b = value & ops.BREAK != 0
+        self.d = value & ops.DECIMAL != 0
+        self.i = value & ops.INTERRUPT != 0
+        self.c = value & ops.CARRY != 0
+
     def load(self, words, address):
-        for w in words:
-            self.mem[address] = w
-            address += 1
+        if not isinstance(words, (bytes, bytearray, memoryview)):
+            words = bytes(words)
+        if address + len(words) > len(self.mem):
+            raise IndexError('Program does not fit into memory')
+
+        self.memory[address:address + len(words)] = words
+        self.dirty_pages.dirty.update(range(address >> 8, ((address + len(words) - 1) >> 8) + 1))
+        self.ops.forget(address, address + len(words))
+
+    def patch(self, patches):
+        for address, words in patches:
+            self.load(words, address)
+
+    def snapshot(self):
+        dirty = self.dirty_pages.dirty
+        if self.pages is None:
+            self.pages = [bytes(self.memory[page << 8:(page + 1) << 8]) for page in range((len(self.mem) + 0xff) >> 8)]
+            self.dirty_pages.trap()
+        else:
+            for page in dirty:
+                self.pages[page] = bytes(self.memory[page << 8:(page + 1) << 8])
+        dirty.clear()
+
+        return Snapshot(tuple(self.pages), [getattr(self, name) for name in registers])
+
+    def restore(self, snapshot):
+        dirty = self.dirty_pages.dirty
+        changed = dirty.union(page for page, (current, restored) in enumerate(zip(self.pages, snapshot.pages))
+                              if current is not restored)
+        for page in changed:
+            self.memory[page << 8:(page + 1) << 8] = snapshot.pages[page]
+            self.ops.forget(page << 8, (page + 1) << 8)
+        self.pages = list(snapshot.pages)
+        dirty.clear()
+
+        for name, value in zip(registers, snapshot.registers):
+            setattr(self, name, value)
 
     def run(self, op_codes=None):
         if op_codes:
             self.load(op_codes, self.pc)
 
-        while self.pc < len(self.mem):
-            op_code = self.mem[self.pc]
-            self.pc += 1
+        self.governor.start(self.cycles)
+        while self.ops.run(min(self.cycles + self.governor.frame, self.scheduler.next)):
+            self.scheduler.run(self.cycles)
+            if self.pending_nmi or self.pending_irq:
+                self.service()
+            self.governor.pace(self.cycles)
+
+    async def run_async(self, op_codes=None, budget=None):
+        if op_codes:
+            self.load(op_codes, self.pc)
+
+        budget = budget or self.governor.frame
+        self.governor.start(self.cycles)
+        while self.ops.run(min(self.cycles + budget, self.scheduler.next)):
+            self.scheduler.run(self.cycles)
+            if self.pending_nmi or self.pending_irq:
+                self.service()
+            await self.governor.pace_async(self.cycles)
+
+    def bound(self, cycle):
+        self.ops.until = min(self.ops.until, cycle)
+
+    def irq(self):
+        self.pending_irq = True
+        self.bound(self.cycles)
 
-            if op_code == 0:
-                break
+    def nmi(self):
+        self.pending_nmi = True
+        self.bound(self.cycles)
 
-            self.exec(op_code)
+    def service(self):
+        if self.pending_nmi:
+            self.pending_nmi = False
+            self.interrupt(0xfffa)
+        elif self.pending_irq and not self.i:
+            self.pending_irq = False
+            self.interrupt(0xfffe)
+
+    def interrupt(self, vector):
+        for what in [self.pc >> 8, self.pc & 0xff, (self.p & ~ops.BREAK) | ops.UNUSED]:
+            self.mem_write(what, self.stack_top + self.sp)
+            self.sp -= 1
+        self.i = True
+        self.pc = self.mem_read(vector) + self.mem_read(vector + 1) * 0x100
+        self.cycles += 7
 
     def exec(self, op_code):
         self.ops.exec(op_code)
 
+    def map(self, device, start, end=None):
+        end = start + 1 if end is None else end
+
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            first = max(start, page << 8)
+            last = min(end, (page + 1) << 8)
+
+            if last - first == 0x100:
+                self.readers[page] = device
+                self.attach(page, device)
+                continue
+
+            if not isinstance(self.readers[page], Page):
+                previous, self.readers[page] = self.readers[page], Page(self)
+                self.attach(page, self.readers[page])
+                if previous is not None:
+                    self.readers[page].devices = dict.fromkeys(range(page << 8, (page + 1) << 8), previous)
+            for address in range(first, last):
+                self.readers[page].devices[address] = device
+
+    def attach(self, page, device):
+        writers = self.writers
+        while page in getattr(writers[page], 'trapped', {}):
+            writers = writers[page].trapped
+        writers[page] = device
+
+    def device(self, where):
+        device = self.readers[where >> 8]
+        if isinstance(device, Page):
+            return device.devices.get(where)
+        return device
+
     def mem_write(self, what, where):
-        if where in self.vmem:
-            self.vmem[where].write(what, where)
-        else:
+        device = self.writers[where >> 8]
+        if device is None:
             self.mem[where] = what
+        else:
+            device.write(what, where)
 
     def mem_read(self, where):
-        if where in self.vmem:
-            return self.vmem[where].read(where)
-        else:
+        device = self.readers[where >> 8]
+        if device is None:
             return self.mem[where]
+        else:
+            return device.read(where)
@@ -1,39 +1,36 @@
-import threading
 import time
 import os
 import msvcrt
 
-from lib import assembler, controller
+from lib import assembler, controller, ops
 
 
 class Debugger(controller.Controller):
-    def __init__(self, mem_size=0xFFFF, pc=0x0600, stack_top=0x0100):
+    def __init__(self, mem_size=0x10000, pc=0x0600, stack_top=0x0100):
         super().__init__(mem_size, pc, stack_top)
+        self.ops = ops.Operations(self, fusion=False)
+        self.loops.enabled = False
         self.break_line = None
 
-        self.running = True
-        self.thread = threading.Thread(target=self.keep_running)
-        self.thread.start()
+        self.scheduler.every(0x1000, self.keep_running)
 
         self.timer = time.time()
         self.instruction_count = 0
 
     def keep_running(self):
-        while self.running:
-            while self.break_line != -1:
-                time.sleep(0.1)
+        if self.break_line != -1:
+            return
 
-            frequency = self.instruction_count / (time.time() - self.timer)
-            self.timer = time.time()
-            self.instruction_count = 0
+        frequency = self.instruction_count / (time.time() - self.timer)
+        self.timer = time.time()
+        self.instruction_count = 0
 
-            os.system('cls' if os.name == 'nt' else 'clear')
-            print('Running with %.2f Hz' % frequency)
-            print('(hit any key to break)')
-            time.sleep(1)
+        os.system('cls' if os.name == 'nt' else 'clear')
+        print('Running with %.2f Hz' % frequency)
+        print('(hit any key to break)')
 
-            if msvcrt.kbhit():
-                self.break_line = None
+        if msvcrt.kbhit():
+            self.break_line = None
 
 
     def exec(self, op_code):
@@ -49,7 +46,6 @@ class Debugger(controller.Controller):
             super().exec(op_code)
         except Exception as e:
             self.print_info()
-            self.running = False
             raise e
 
     def print_info(self):
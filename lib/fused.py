@@ -0,0 +1,170 @@
+from lib import ops
+
+addresses = {
+    'zp': ['address = {lo}'],
+    'zpx': ['address = ({lo} + c.x) % 0xff'],
+    'zpy': ['address = ({lo} + c.y) % 0xff'],
+    'ab': ['address = {lo} + {hi} * 0x100'],
+    'abx': ['address = {lo} + {hi} * 0x100 + c.x'],
+    'aby': ['address = {lo} + {hi} * 0x100 + c.y'],
+    'inx': ['pointer = {lo} + c.x',
+            'address = mem_read(pointer) + mem_read(pointer + 1) * 0x100'],
+    'iny': ['pointer = {lo}',
+            'low = mem_read(pointer)',
+            'address = low + mem_read(pointer + 1) * 0x100 + c.y'],
+}
+
+crossings = {
+    'abx': '{lo} + c.x > 0xff',
+    'aby': '{lo} + c.y > 0xff',
+    'iny': 'low + c.y > 0xff',
+}
+
+result = [
+    'result = result % 0x100',
+    'c.nz = result',
+]
+
+arithmetic = [
+    'c.a = result & 0xff',
+    'c.nz = result >> 8 & 0xff',
+    'c.c = result & 0x10000 != 0',
+    'c.v = result & 0x20000 != 0',
+]
+
+reading = {
+    'adc': ['result = adc_table[value | c.a << 8 | c.c << 16 | c.d << 17]'] + arithmetic,
+    'and': ['c.a = c.a & value'],
+    'bit': ['c.nz = nz_of(value & 0x80, (value & c.a) == 0)', 'c.v = (value & 0x40) != 0'],
+    'cmp': ['c.z = c.a == value'],
+    'cpx': ['c.z = c.x == value'],
+    'dec': ['result = value - 1'] + result + ['mem_write(result, address)'],
+    'inc': ['result = value + 1'] + result + ['mem_write(result, address)'],
+    'lda': ['c.a = value'],
+    'ldx': ['c.x = value'],
+    'ldy': ['c.y = value'],
+    'sbc': ['result = sbc_table[value | c.a << 8 | c.c << 16 | c.d << 17]'] + arithmetic,
+}
+
+writing = {
+    'sta': ['mem_write(c.a, address)'],
+    'stx': ['mem_write(c.x, address)'],
+    'sty': ['mem_write(c.y, address)'],
+}
+
+branches = {
+    'bcc': 'not c.c',
+    'bcs': 'c.c',
+    'beq': 'not c.nz & 0xff',
+    'bmi': 'c.nz & 0x180',
+    'bne': 'c.nz & 0xff',
+    'bpl': 'not c.nz & 0x180',
+}
+
+implied = {
+    'brk': ['pass'],
+    'clc': ['c.c = False'],
+    'cld': ['c.d = False'],
+    'cli': ['c.i = False'],
+    'clv': ['c.v = False'],
+    'dex': ['result = c.x - 1'] + result + ['c.x = result'],
+    'inx': ['result = c.x + 1'] + result + ['c.x = result'],
+    'iny': ['result = c.y + 1'] + result + ['c.y = result'],
+    'jmp': ['c.pc = {lo} + {hi} * 0x100'],
+    'jsr': ['mem_write(({next}) // 0x100, c.stack_top + c.sp)',
+            'c.sp -= 1',
+            'mem_write(({next}) % 0x100, c.stack_top + c.sp)',
+            'c.sp -= 1',
+            'c.pc = {lo} + {hi} * 0x100'],
+    'lsr': ['c.c = c.a & 1 == 1', 'c.a = c.a >> 1'],
+    'nop': ['pass'],
+    'pha': ['mem_write(c.a, c.stack_top + c.sp)', 'c.sp -= 1'],
+    'php': ['mem_write(c.p | 0x10, c.stack_top + c.sp)', 'c.sp -= 1'],
+    'pla': ['c.sp += 1', 'c.a = mem_read(c.stack_top + c.sp)'],
+    'plp': ['c.sp += 1', 'c.p = mem_read(c.stack_top + c.sp)'],
+    'rti': ['c.p = mem_read(c.stack_top + c.sp + 1)',
+            'c.pc = mem_read(c.stack_top + c.sp + 2) + mem_read(c.stack_top + c.sp + 3) * 0x100',
+            'c.sp += 3'],
+    'rts': ['c.pc = mem_read(c.stack_top + c.sp + 1) + mem_read(c.stack_top + c.sp + 2) * 0x100',
+            'c.sp += 2',
+            'if c.on_return is not None:',
+            '    c.on_return()'],
+    'sec': ['c.c = True'],
+    'sed': ['c.d = True'],
+    'sei': ['c.i = True'],
+    'tax': ['c.x = c.a'],
+    'txa': ['c.a = c.x'],
+    'tya': ['c.a = c.y'],
+}
+
+not_implemented = ["raise Exception('Not implemented')"]
+
+implied_modes = {
+    'jmp': ['ab', 'in'],
+    'jsr': ['ab'],
+    'lsr': ['a'],
+}
+
+
+def implemented(inst, mode):
+    if inst in reading or inst in writing or inst in branches:
+        return True
+    return inst in implied and mode in implied_modes.get(inst, [None])
+
+
+def instruction(inst, mode, lo, hi, next_pc, target):
+    if not implemented(inst, mode):
+        lines = not_implemented
+    elif inst in reading:
+        if mode == 'im':
+            lines = ['value = {lo}']
+        else:
+            lines = addresses[mode] + ['value = mem_read(address)']
+        if mode in crossings and inst not in ['dec', 'inc']:
+            lines = lines + ['if ' + crossings[mode] + ':', '    c.cycles += 1']
+        lines = lines + reading[inst]
+    elif inst in writing:
+        lines = addresses[mode] + writing[inst]
+    elif inst in branches:
+        taken = target[0] + ['c.cycles += ' + target[2], 'c.pc = ' + target[1]] + target[3]
+        lines = ['if ' + branches[inst] + ':'] + ['    ' + l for l in taken]
+    else:
+        lines = implied[inst]
+
+    return [l.format(lo=lo, hi=hi, next=next_pc) for l in lines]
+
+
+def handler(op_code):
+    inst, mode = ops.instructions[op_code]
+    size = ops.sizes[mode]
+    target = (['offset = mem_read(pc)', 'target = pc + 1 + (offset if offset < 0x80 else offset - 0x100)'],
+              'target', '1 if target >> 8 == (pc + 1) >> 8 else 2',
+              ['if offset >= 0x80:', '    skip(target, pc + 1)'])
+
+    body = instruction(inst, mode, 'mem_read(pc)', 'mem_read(pc + 1)', 'pc + %d' % size, target)
+
+    lines = ['def op_%02x():' % op_code]
+    if size and implemented(inst, mode):
+        lines += ['    pc = c.pc', '    c.pc = pc + %d' % size]
+    return lines + ['    ' + l for l in body]
+
+
+def source():
+    lines = ['def build(c):', '    mem_read = c.mem_read', '    mem_write = c.mem_write', '    skip = c.loops.skip']
+    for op_code in sorted(ops.instructions):
+        lines += ['    ' + l for l in handler(op_code)]
+    lines.append('    return {%s}' % ', '.join('0x%02x: op_%02x' % (o, o) for o in sorted(ops.instructions)))
+    return '\n'.join(lines) + '\n'
+
+
+namespace = {'nz_of': ops.nz_of, 'adc_table': ops.adc_table, 'sbc_table': ops.sbc_table}
+exec(compile(source(), '<fused>', 'exec'), namespace)
+build = namespace['build']
+
+
+class FusedOperations(ops.Operations):
+    def __init__(self, controller):
+        super().__init__(controller, fusion=False)
+
+        for op_code, function in build(controller).items():
+            self.table[op_code] = function
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+
+class Governor:
+    def __init__(self, clock=None, frame_rate=60, max_lag=0.25):
+        self.clock = clock
+        self.frame = max(1, clock // frame_rate) if clock else 0x10000
+        self.max_lag = max_lag
+        self.start_time = 0
+        self.start_cycles = 0
+
+    def start(self, cycles):
+        self.start_time = time.perf_counter()
+        self.start_cycles = cycles
+
+    def delay(self, cycles):
+        if not self.clock:
+            return 0
+
+        delay = self.start_time + (cycles - self.start_cycles) / self.clock - time.perf_counter()
+        if delay > 0:
+            return delay
+        if -delay > self.max_lag:
+            self.start(cycles)
+        return 0
+
+    def pace(self, cycles):
+        delay = self.delay(cycles)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def pace_async(self, cycles):
+        await asyncio.sleep(self.delay(cycles))
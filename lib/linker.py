@@ -0,0 +1,55 @@
+import concurrent.futures
+
+from lib import assembler, cache
+
+
+class Linker:
+    def __init__(self):
+        self.modules = []
+        self.labels = {}
+
+    def add(self, obj, address):
+        self.modules.append((obj, address))
+
+    def exports(self):
+        exports = {}
+        for obj, address in self.modules:
+            for label, offset in obj.labels.items():
+                exports.setdefault(label, []).append(address + offset)
+        return exports
+
+    def link(self):
+        exports = self.exports()
+        self.labels = dict((label, addresses[0]) for label, addresses in exports.items() if len(addresses) == 1)
+
+        segments = []
+        for obj, address in self.modules:
+            code = list(obj.code)
+            for offset, relative, label in obj.fixups:
+                if label in obj.labels:
+                    target = address + obj.labels[label]
+                elif len(exports.get(label, [])) == 1:
+                    target = exports[label][0]
+                elif label in exports:
+                    raise Exception('Label [%s] is defined in more than one module' % label)
+                else:
+                    raise Exception('Undefined label [%s]' % label)
+                assembler.Assembler.fix(code, offset, address + offset, target, relative)
+            segments.append((address, bytes(code)))
+        return segments
+
+
+def compile_module(source, cached=True):
+    asm = cache.CachedAssembler() if cached else assembler.Assembler()
+    return asm.compile(source)
+
+
+def build(modules, workers=None, cached=True):
+    sources = [source for source, address in modules]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        objects = list(executor.map(compile_module, sources, [cached] * len(sources)))
+
+    linker = Linker()
+    for obj, (source, address) in zip(objects, modules):
+        linker.add(obj, address)
+    return linker.link()
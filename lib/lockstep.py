@@ -0,0 +1,320 @@
+import numpy
+
+from lib import fused, ops
+
+cycle_table = numpy.array(ops.cycle_table, numpy.int64)
+nz_flags = numpy.array(ops.nz_flags, numpy.int64)
+adc_table = numpy.frombuffer(ops.adc_table, numpy.uint32).astype(numpy.int64)
+sbc_table = numpy.frombuffer(ops.sbc_table, numpy.uint32).astype(numpy.int64)
+
+branches = {
+    'bcc': lambda m, l: ~m.c[l],
+    'bcs': lambda m, l: m.c[l],
+    'beq': lambda m, l: m.nz[l] & 0xff == 0,
+    'bmi': lambda m, l: m.nz[l] & 0x180 != 0,
+    'bne': lambda m, l: m.nz[l] & 0xff != 0,
+    'bpl': lambda m, l: m.nz[l] & 0x180 == 0,
+}
+
+
+def nz_of(negative, zero):
+    return numpy.where(zero, numpy.where(negative, 0x100, 0), numpy.where(negative, 0x80, 1))
+
+
+class Lockstep:
+    def __init__(self, lanes, mem_size=0x10000, pc=0x0600, stack_top=0x0100):
+        self.lanes = lanes
+        self.mem = numpy.zeros((lanes, mem_size), numpy.uint8)
+        self.stack_top = stack_top
+
+        self.pc = numpy.full(lanes, pc, numpy.int64)
+        self.sp = numpy.full(lanes, 0xff, numpy.int64)
+        self.a = numpy.zeros(lanes, numpy.int64)
+        self.x = numpy.zeros(lanes, numpy.int64)
+        self.y = numpy.zeros(lanes, numpy.int64)
+        self.cycles = numpy.zeros(lanes, numpy.int64)
+
+        self.nz = numpy.ones(lanes, numpy.int64)
+        self.v = numpy.zeros(lanes, bool)
+        self.u = numpy.ones(lanes, bool)
+        self.b = numpy.zeros(lanes, bool)
+        self.d = numpy.zeros(lanes, bool)
+        self.i = numpy.zeros(lanes, bool)
+        self.c = numpy.zeros(lanes, bool)
+
+        self.running = numpy.ones(lanes, bool)
+        self.errors = [None] * lanes
+
+        self.table = [self.fail('Illegal op code %02x' % op_code) for op_code in range(0x100)]
+        for op_code, (inst, mode) in ops.instructions.items():
+            self.table[op_code] = self.handler(inst, mode)
+
+    @property
+    def n(self):
+        return self.nz & 0x180 != 0
+
+    @property
+    def z(self):
+        return self.nz & 0xff == 0
+
+    @property
+    def p(self):
+        return (nz_flags[self.nz] |
+                numpy.where(self.v, ops.OVERFLOW, 0) |
+                numpy.where(self.u, ops.UNUSED, 0) |
+                numpy.where(self.b, ops.BREAK, 0) |
+                numpy.where(self.d, ops.DECIMAL, 0) |
+                numpy.where(self.i, ops.INTERRUPT, 0) |
+                numpy.where(self.c, ops.CARRY, 0))
+
+    def load(self, words, address):
+        words = numpy.frombuffer(bytes(words), numpy.uint8)
+        if address + len(words) > self.mem.shape[1]:
+            raise IndexError('Program does not fit into memory')
+
+        self.mem[:, address:address + len(words)] = words
+
+    def run(self, until=None):
+        while True:
+            active = self.running if until is None else self.running & (self.cycles < until)
+            if not active.any():
+                return bool(self.running.any())
+            self.step(numpy.flatnonzero(active))
+
+    def step(self, l):
+        ended = self.pc[l] >= self.mem.shape[1]
+        self.running[l[ended]] = False
+        l = l[~ended]
+
+        op_codes = self.mem[l, self.pc[l]]
+        self.pc[l] += 1
+
+        brk = op_codes == 0
+        self.running[l[brk]] = False
+        l, op_codes = l[~brk], op_codes[~brk]
+
+        self.cycles[l] += cycle_table[op_codes]
+
+        order = numpy.argsort(op_codes, kind='stable')
+        l, op_codes = l[order], op_codes[order]
+        codes, starts = numpy.unique(op_codes, return_index=True)
+        for op_code, lanes in zip(codes, numpy.split(l, starts[1:])):
+            self.table[op_code](lanes)
+
+    def fail(self, message):
+        def handler(l):
+            self.running[l] = False
+            for lane in l:
+                self.errors[lane] = message
+        return handler
+
+    def handler(self, inst, mode):
+        if not fused.implemented(inst, mode):
+            return self.fail('Not implemented')
+
+        if inst in fused.reading:
+            operation = getattr(self, 'inst_' + inst)
+            crossing = inst not in ['dec', 'inc']
+
+            def read(l):
+                if mode == 'im':
+                    address = None
+                    value = self.operand(l)
+                else:
+                    address = self.address(l, mode, crossing)
+                    value = self.mem[l, address].astype(numpy.int64)
+                self.pc[l] += ops.sizes[mode]
+                operation(l, value, address)
+            return read
+
+        if inst in fused.writing:
+            register = inst[2]
+
+            def write(l):
+                address = self.address(l, mode, False)
+                self.pc[l] += ops.sizes[mode]
+                self.mem[l, address] = getattr(self, register)[l]
+            return write
+
+        if inst in fused.branches:
+            condition = branches[inst]
+
+            def branch(l):
+                taken = condition(self, l)
+                t = l[taken]
+                offset = self.operand(t)
+                pc = self.pc[t] + 1
+                target = pc + numpy.where(offset < 0x80, offset, offset - 0x100)
+                self.cycles[t] += numpy.where(target >> 8 == pc >> 8, 1, 2)
+                self.pc[t] = target
+                self.pc[l[~taken]] += 1
+            return branch
+
+        return getattr(self, 'inst_' + inst)
+
+    def operand(self, l, offset=0):
+        return self.mem[l, self.pc[l] + offset].astype(numpy.int64)
+
+    def word(self, l, address):
+        return self.mem[l, address].astype(numpy.int64) + self.mem[l, address + 1].astype(numpy.int64) * 0x100
+
+    def address(self, l, mode, crossing):
+        lo = self.operand(l)
+        if mode == 'zp':
+            return lo
+        if mode == 'zpx':
+            return (lo + self.x[l]) % 0xff
+        if mode == 'zpy':
+            return (lo + self.y[l]) % 0xff
+        if mode == 'inx':
+            return self.word(l, lo + self.x[l])
+
+        if mode == 'iny':
+            low, address, index = self.mem[l, lo].astype(numpy.int64), self.word(l, lo), self.y[l]
+        else:
+            low = lo
+            address = lo + self.operand(l, 1) * 0x100
+            index = {'ab': 0, 'abx': self.x[l], 'aby': self.y[l]}[mode]
+
+        if crossing and mode != 'ab':
+            self.cycles[l] += low + index > 0xff
+        return address + index
+
+    def push(self, l, what):
+        self.mem[l, self.stack_top + self.sp[l]] = what
+        self.sp[l] -= 1
+
+    def pull(self, l):
+        self.sp[l] += 1
+        return self.mem[l, self.stack_top + self.sp[l]].astype(numpy.int64)
+
+    def inst_adc(self, l, value, address):
+        self.arithmetic(l, adc_table, value)
+
+    def inst_and(self, l, value, address):
+        self.a[l] &= value
+
+    def inst_bit(self, l, value, address):
+        self.nz[l] = nz_of(value & 0x80, (value & self.a[l]) == 0)
+        self.v[l] = value & 0x40 != 0
+
+    def inst_cmp(self, l, value, address):
+        self.nz[l] = nz_of(self.nz[l] & 0x180, self.a[l] == value)
+
+    def inst_cpx(self, l, value, address):
+        self.nz[l] = nz_of(self.nz[l] & 0x180, self.x[l] == value)
+
+    def inst_dec(self, l, value, address):
+        self.nz[l] = result = (value - 1) % 0x100
+        self.mem[l, address] = result
+
+    def inst_inc(self, l, value, address):
+        self.nz[l] = result = (value + 1) % 0x100
+        self.mem[l, address] = result
+
+    def inst_lda(self, l, value, address):
+        self.a[l] = value
+
+    def inst_ldx(self, l, value, address):
+        self.x[l] = value
+
+    def inst_ldy(self, l, value, address):
+        self.y[l] = value
+
+    def inst_sbc(self, l, value, address):
+        self.arithmetic(l, sbc_table, value)
+
+    def arithmetic(self, l, table, value):
+        result = table[value | self.a[l] << 8 | self.c[l].astype(numpy.int64) << 16 |
+                       self.d[l].astype(numpy.int64) << 17]
+        self.a[l] = result & 0xff
+        self.nz[l] = result >> 8 & 0xff
+        self.c[l] = result & 0x10000 != 0
+        self.v[l] = result & 0x20000 != 0
+
+    def inst_brk(self, l):
+        pass
+
+    def inst_clc(self, l):
+        self.c[l] = False
+
+    def inst_cld(self, l):
+        self.d[l] = False
+
+    def inst_cli(self, l):
+        self.i[l] = False
+
+    def inst_clv(self, l):
+        self.v[l] = False
+
+    def inst_dex(self, l):
+        self.x[l] = self.nz[l] = (self.x[l] - 1) % 0x100
+
+    def inst_inx(self, l):
+        self.x[l] = self.nz[l] = (self.x[l] + 1) % 0x100
+
+    def inst_iny(self, l):
+        self.y[l] = self.nz[l] = (self.y[l] + 1) % 0x100
+
+    def inst_jmp(self, l):
+        self.pc[l] = self.word(l, self.pc[l])
+
+    def inst_jsr(self, l):
+        next_pc = self.pc[l] + 2
+        self.push(l, next_pc // 0x100)
+        self.push(l, next_pc % 0x100)
+        self.pc[l] = self.word(l, self.pc[l])
+
+    def inst_lsr(self, l):
+        self.c[l] = self.a[l] & 1 == 1
+        self.a[l] >>= 1
+
+    def inst_nop(self, l):
+        pass
+
+    def inst_pha(self, l):
+        self.push(l, self.a[l])
+
+    def inst_php(self, l):
+        self.push(l, self.p[l] | ops.BREAK)
+
+    def inst_pla(self, l):
+        self.a[l] = self.pull(l)
+
+    def inst_plp(self, l):
+        self.status(l, self.pull(l))
+
+    def inst_rti(self, l):
+        self.status(l, self.pull(l))
+        self.pc[l] = self.pull(l) + self.pull(l) * 0x100
+
+    def status(self, l, value):
+        self.nz[l] = nz_of(value & ops.NEGATIVE, value & ops.ZERO)
+        self.v[l] = value & ops.OVERFLOW != 0
+        self.u[l] = value & ops.UNUSED != 0
+        self.b[l] = value & ops.BREAK != 0
+        self.d[l] = value & ops.DECIMAL != 0
+        self.i[l] = value & ops.INTERRUPT != 0
+        self.c[l] = value & ops.CARRY != 0
+
+    def inst_rts(self, l):
+        self.pc[l] = self.word(l, self.stack_top + self.sp[l] + 1)
+        self.sp[l] += 2
+
+    def inst_sec(self, l):
+        self.c[l] = True
+
+    def inst_sed(self, l):
+        self.d[l] = True
+
+    def inst_sei(self, l):
+        self.i[l] = True
+
+    def inst_tax(self, l):
+        self.x[l] = self.a[l]
+
+    def inst_txa(self, l):
+        self.a[l] = self.x[l]
+
+    def inst_tya(self, l):
+        self.a[l] = self.y[l]
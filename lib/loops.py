@@ -0,0 +1,84 @@
+from lib import ops
+
+counters = {'dex': ('x', -1), 'inx': ('x', 1), 'iny': ('y', 1)}
+polls = {'lda', 'ldx', 'ldy', 'cmp', 'cpx', 'and', 'bit'}
+
+
+class LoopDetector:
+    max_length = 8
+
+    def __init__(self, controller):
+        self.c = controller
+        self.enabled = True
+        self.loops = {}
+
+    def skip(self, start, end):
+        if not self.enabled:
+            return
+
+        loop = self.loops.get((start, end))
+        if loop is None:
+            loop = self.loops[(start, end)] = self.analyse(start, end)
+
+        code, handler = loop
+        if handler is not None and self.c.mem[start:end] == code:
+            handler(start, end)
+
+    def analyse(self, start, end):
+        mem = self.c.mem
+        code = bytes(mem[start:end])
+
+        decoded = []
+        pc = start
+        while pc < end - 2 and len(decoded) < self.max_length:
+            if mem[pc] not in ops.instructions:
+                return code, None
+            inst, mode = ops.instructions[mem[pc]]
+            decoded.append((pc, inst, mode))
+            pc += 1 + ops.sizes[mode]
+        if pc != end - 2 or mem[pc] not in ops.instructions:
+            return code, None
+
+        branch = ops.instructions[mem[pc]][0]
+        body = [inst for pc, inst, mode in decoded if inst != 'nop']
+        body_cycles = sum(ops.cycles[(inst, mode)] for pc, inst, mode in decoded)
+
+        if branch == 'bne' and len(body) == 1 and body[0] in counters:
+            return code, self.countdown(counters[body[0]], body_cycles, self.taken(start, end))
+
+        if branch in ['beq', 'bne', 'bmi', 'bpl'] and body and all(inst in polls for inst in body):
+            if self.polls_device(decoded):
+                return code, self.poll(body_cycles + self.taken(start, end))
+
+        return code, None
+
+    def polls_device(self, decoded):
+        reads = []
+        for pc, inst, mode in decoded:
+            if mode in ['zp', 'ab']:
+                reads.append(self.c.mem[pc + 1] + (self.c.mem[pc + 2] * 0x100 if mode == 'ab' else 0))
+            elif mode not in [None, 'im']:
+                return False
+        return len(reads) > 0 and all(self.c.device(address) is not None for address in reads)
+
+    @staticmethod
+    def taken(start, end):
+        return 3 if start >> 8 == end >> 8 else 4
+
+    def countdown(self, counter, body_cycles, taken_cycles):
+        register, step = counter
+
+        def handler(start, end):
+            c = self.c
+            count = (-getattr(c, register) * step) % 0x100
+            c.cycles += count * body_cycles + (count - 1) * taken_cycles + 2
+            setattr(c, register, 0)
+            c.nz = 0
+            c.pc = end
+        return handler
+
+    def poll(self, iteration_cycles):
+        def handler(start, end):
+            c = self.c
+            c.cycles += max(0, c.ops.until - c.cycles) // iteration_cycles * iteration_cycles
+        return handler
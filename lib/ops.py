@@ -1,5 +1,5 @@
 import inspect
-import time
+from array import array
 
 op_codes = {
     ('adc', 'im'): 0x69,
@@ -155,8 +155,233 @@ op_codes = {
     ('sty', 'ab'): 0x8C,
 }
 
+cycles = {
+    ('adc', 'im'): 2,
+    ('adc', 'zp'): 3,
+    ('adc', 'zpx'): 4,
+    ('adc', 'ab'): 4,
+    ('adc', 'abx'): 4,
+    ('adc', 'aby'): 4,
+    ('adc', 'inx'): 6,
+    ('adc', 'iny'): 5,
+    ('and', 'im'): 2,
+    ('and', 'zp'): 3,
+    ('and', 'zpx'): 4,
+    ('and', 'ab'): 4,
+    ('and', 'abx'): 4,
+    ('and', 'aby'): 4,
+    ('and', 'inx'): 6,
+    ('and', 'iny'): 5,
+    ('asl', 'a'): 2,
+    ('asl', 'zp'): 5,
+    ('asl', 'zpx'): 6,
+    ('asl', 'ab'): 6,
+    ('asl', 'abx'): 7,
+    ('bit', 'zp'): 3,
+    ('bit', 'ab'): 4,
+    ('bpl', 'im'): 2,
+    ('bmi', 'im'): 2,
+    ('bvc', 'im'): 2,
+    ('bvs', 'im'): 2,
+    ('bcc', 'im'): 2,
+    ('bcs', 'im'): 2,
+    ('bne', 'im'): 2,
+    ('beq', 'im'): 2,
+    ('brk', None): 7,
+    ('cmp', 'im'): 2,
+    ('cmp', 'zp'): 3,
+    ('cmp', 'zpx'): 4,
+    ('cmp', 'ab'): 4,
+    ('cmp', 'abx'): 4,
+    ('cmp', 'aby'): 4,
+    ('cmp', 'inx'): 6,
+    ('cmp', 'iny'): 5,
+    ('cpx', 'im'): 2,
+    ('cpx', 'zp'): 3,
+    ('cpx', 'ab'): 4,
+    ('cpy', 'im'): 2,
+    ('cpy', 'zp'): 3,
+    ('cpy', 'ab'): 4,
+    ('dec', 'zp'): 5,
+    ('dec', 'zpx'): 6,
+    ('dec', 'ab'): 6,
+    ('dec', 'abx'): 7,
+    ('eor', 'im'): 2,
+    ('eor', 'zp'): 3,
+    ('eor', 'zpx'): 4,
+    ('eor', 'ab'): 4,
+    ('eor', 'abx'): 4,
+    ('eor', 'aby'): 4,
+    ('eor', 'inx'): 6,
+    ('eor', 'iny'): 5,
+    ('clc', None): 2,
+    ('sec', None): 2,
+    ('cli', None): 2,
+    ('sei', None): 2,
+    ('clv', None): 2,
+    ('cld', None): 2,
+    ('sed', None): 2,
+    ('inc', 'zp'): 5,
+    ('inc', 'zpx'): 6,
+    ('inc', 'ab'): 6,
+    ('inc', 'abx'): 7,
+    ('jmp', 'ab'): 3,
+    ('jmp', 'in'): 5,
+    ('jsr', 'ab'): 6,
+    ('lda', 'im'): 2,
+    ('lda', 'zp'): 3,
+    ('lda', 'zpx'): 4,
+    ('lda', 'ab'): 4,
+    ('lda', 'abx'): 4,
+    ('lda', 'aby'): 4,
+    ('lda', 'inx'): 6,
+    ('lda', 'iny'): 5,
+    ('ldx', 'im'): 2,
+    ('ldx', 'zp'): 3,
+    ('ldx', 'zpy'): 4,
+    ('ldx', 'ab'): 4,
+    ('ldx', 'aby'): 4,
+    ('ldy', 'im'): 2,
+    ('ldy', 'zp'): 3,
+    ('ldy', 'zpx'): 4,
+    ('ldy', 'ab'): 4,
+    ('ldy', 'abx'): 4,
+    ('lsr', 'a'): 2,
+    ('lsr', 'zp'): 5,
+    ('lsr', 'zpx'): 6,
+    ('lsr', 'ab'): 6,
+    ('lsr', 'abx'): 7,
+    ('nop', None): 2,
+    ('ora', 'im'): 2,
+    ('ora', 'zp'): 3,
+    ('ora', 'zpx'): 4,
+    ('ora', 'ab'): 4,
+    ('ora', 'abx'): 4,
+    ('ora', 'aby'): 4,
+    ('ora', 'inx'): 6,
+    ('ora', 'iny'): 5,
+    ('tax', None): 2,
+    ('txa', None): 2,
+    ('dex', None): 2,
+    ('inx', None): 2,
+    ('tay', None): 2,
+    ('tya', None): 2,
+    ('dey', None): 2,
+    ('iny', None): 2,
+    ('rol', 'a'): 2,
+    ('rol', 'zp'): 5,
+    ('rol', 'zpx'): 6,
+    ('rol', 'ab'): 6,
+    ('rol', 'abx'): 7,
+    ('ror', 'a'): 2,
+    ('ror', 'zp'): 5,
+    ('ror', 'zpx'): 6,
+    ('ror', 'ab'): 6,
+    ('ror', 'abx'): 7,
+    ('rti', None): 6,
+    ('rts', None): 6,
+    ('sbc', 'im'): 2,
+    ('sbc', 'zp'): 3,
+    ('sbc', 'zpx'): 4,
+    ('sbc', 'ab'): 4,
+    ('sbc', 'abx'): 4,
+    ('sbc', 'aby'): 4,
+    ('sbc', 'inx'): 6,
+    ('sbc', 'iny'): 5,
+    ('sta', 'zp'): 3,
+    ('sta', 'zpx'): 4,
+    ('sta', 'ab'): 4,
+    ('sta', 'abx'): 5,
+    ('sta', 'aby'): 5,
+    ('sta', 'inx'): 6,
+    ('sta', 'iny'): 6,
+    ('txs', None): 2,
+    ('tsx', None): 2,
+    ('pha', None): 3,
+    ('pla', None): 4,
+    ('php', None): 3,
+    ('plp', None): 4,
+    ('stx', 'zp'): 3,
+    ('stx', 'zpy'): 4,
+    ('stx', 'ab'): 4,
+    ('sty', 'zp'): 3,
+    ('sty', 'zpx'): 4,
+    ('sty', 'ab'): 4,
+}
+
+NEGATIVE = 0x80
+OVERFLOW = 0x40
+UNUSED = 0x20
+BREAK = 0x10
+DECIMAL = 0x08
+INTERRUPT = 0x04
+ZERO = 0x02
+CARRY = 0x01
+
+nz_flags = [(NEGATIVE if v & 0x180 else 0) | (ZERO if v & 0xff == 0 else 0) for v in range(0x200)]
+
+
+def nz_of(negative, zero):
+    if zero:
+        return 0x100 if negative else 0
+    return 0x80 if negative else 1
+
+
+sizes = {None: 0, 'a': 0, 'im': 1, 'zp': 1, 'zpx': 1, 'zpy': 1, 'inx': 1, 'iny': 1,
+         'ab': 2, 'abx': 2, 'aby': 2, 'in': 2}
+
 instructions = dict([(op_codes[i], i) for i in op_codes])
 mnemonics = [i for i, a in op_codes if a is None]
+cycle_table = [cycles.get(instructions.get(op_code), 0) for op_code in range(0x100)]
+
+
+def op_codes_of(inst, mode=None):
+    return [o for (i, m), o in op_codes.items() if i == inst and (mode is None or m == mode)]
+
+
+def add(a, value, carry, decimal):
+    binary = a + value + carry
+    if decimal:
+        low = (a & 0xf) + (value & 0xf) + carry
+        high = (a >> 4) + (value >> 4) + (1 if low > 9 else 0)
+        alu = (high & 0xf) << 4 | (low & 0xf)
+        result = ((high + (6 if high > 9 else 0)) & 0xf) << 4 | ((low + (6 if low > 9 else 0)) & 0xf)
+        carry = high > 9
+    else:
+        alu = result = binary & 0xff
+        carry = binary > 0xff
+    overflow = ~(a ^ value) & (a ^ alu) & 0x80
+    return result | alu << 8 | (0x10000 if carry else 0) | (0x20000 if overflow else 0)
+
+
+def subtract(a, value, carry, decimal):
+    binary = a + (value ^ 0xff) + carry
+    alu = binary & 0xff
+    result = alu
+    if decimal:
+        low = (a & 0xf) + (~value & 0xf) + carry
+        high = (a >> 4) + (~value >> 4 & 0xf) + (1 if low > 0xf else 0)
+        result = ((alu + (0 if high > 0xf else 0xa0)) & 0xf0) | ((alu + (0 if low > 0xf else 0xa)) & 0xf)
+    overflow = (a ^ value) & (a ^ alu) & 0x80
+    return result | alu << 8 | (0x10000 if binary > 0xff else 0) | (0x20000 if overflow else 0)
+
+
+def arithmetic_table(operation):
+    return array('I', [operation(i >> 8 & 0xff, i & 0xff, i >> 16 & 1, i >> 17) for i in range(0x40000)])
+
+
+adc_table = arithmetic_table(add)
+sbc_table = arithmetic_table(subtract)
+
+pairs = {
+    'dex bne': (op_codes_of('dex'), op_codes_of('bne')),
+    'cmp bne': (op_codes_of('cmp'), op_codes_of('bne')),
+    'lda sta': (op_codes_of('lda'), op_codes_of('sta')),
+    'iny bne': (op_codes_of('iny'), op_codes_of('bne')),
+    'sta ($00),y iny': (op_codes_of('sta', 'iny'), op_codes_of('iny')),
+}
+
+arguments = {}
 
 
 class Addressing:
@@ -188,10 +413,8 @@ class Addressing:
         return self.c.mem_read(self.c.stack_top + self.c.sp)
 
     def result(self, what):
-        self.c.v = what >= 0x80
-        what = self.bcd(what % 0x100)
-        self.c.z = what == 0
-        self.c.n = what > 0x80
+        what = what % 0x100
+        self.c.nz = what
         return what
 
     def read_two_bytes(self, address):
@@ -217,48 +440,178 @@ class Addressing:
     def write_zpx(self, what):
         self.c.mem_write(what, (self.read_im() + self.c.x) % 0xff)
 
+    def read_zpy(self):
+        return self.c.mem_read((self.read_im() + self.c.y) % 0xff)
+
+    def write_zpy(self, what):
+        self.c.mem_write(what, (self.read_im() + self.c.y) % 0xff)
+
     def read_ab(self):
         return self.c.mem_read(self.read_double_im())
 
     def write_ab(self, what):
         self.c.mem_write(what, self.read_double_im())
 
+    def indexed(self, address, index):
+        if address % 0x100 + index > 0xff:
+            self.c.cycles += 1
+        return address + index
+
+    def read_abx(self):
+        return self.c.mem_read(self.indexed(self.read_double_im(), self.c.x))
+
     def write_abx(self, what):
         self.c.mem_write(what, self.read_double_im() + self.c.x)
 
+    def read_aby(self):
+        return self.c.mem_read(self.indexed(self.read_double_im(), self.c.y))
+
     def write_aby(self, what):
         self.c.mem_write(what, self.read_double_im() + self.c.y)
 
+    def read_inx(self):
+        return self.c.mem_read(self.read_two_bytes(self.read_im() + self.c.x))
+
     def write_inx(self, what):
         self.c.mem_write(what, self.read_two_bytes(self.read_im() + self.c.x))
 
+    def read_iny(self):
+        return self.c.mem_read(self.indexed(self.read_two_bytes(self.read_im()), self.c.y))
+
     def write_iny(self, what):
         self.c.mem_write(what, self.read_two_bytes(self.read_im()) + self.c.y)
 
 
 class Operations:
-    def __init__(self, controller):
+    def __init__(self, controller, fusion=True):
         self.c = controller
         self.x = Addressing(controller)
+        self.table = [self.illegal(op_code) for op_code in range(0x100)]
+        self.fusions = {}
+        self.until = 0
+
+        for op_code, (inst, mode) in instructions.items():
+            self.table[op_code] = self.handler(inst, mode)
+
+        self.firsts = {}
+        self.fused = {} if fusion else None
+        self.decoded = set()
+        if fusion:
+            for name, (firsts, seconds) in pairs.items():
+                self.fusions[name] = 0
+                for op_code in firsts:
+                    self.firsts[op_code] = (name, self.table[op_code], seconds)
+                    self.table[op_code] = self.decoder(op_code)
+
+    def run(self, until):
+        c = self.c
+        self.until = until
+        fused = {} if self.fused is None else self.fused
+        while c.cycles < self.until:
+            pair = fused.get(c.pc)
+            if pair is not None:
+                pair()
+                continue
+
+            if c.pc >= len(c.mem):
+                return False
+
+            op_code = c.mem[c.pc]
+            c.pc += 1
+
+            if op_code == 0:
+                return False
+
+            c.cycles += cycle_table[op_code]
+            c.exec(op_code)
+        return True
 
     def exec(self, op_code):
-        inst, mode = instructions[op_code]
+        self.table[op_code]()
+
+    def handler(self, inst, mode):
         inst_method = getattr(self, 'inst_' + inst)
-        args = inspect.getargspec(inst_method).args
+        read = getattr(self.x, 'read_' + str(mode), None)
+        write = getattr(self.x, 'write_' + str(mode), None)
+
+        if mode is not None and self.takes_argument(inst):
+            if write is None:
+                return lambda: inst_method(read())
+
+            def read_write():
+                result = inst_method(read())
+                if result is not None:
+                    write(result)
+            return read_write
 
-        if mode is None or len(args) == 1:
+        if write is None:
+            return inst_method
+
+        def write_only():
             result = inst_method()
-        else:
-            arg = getattr(self.x, 'read_' + mode)()
-            result = inst_method(arg)
+            if result is not None:
+                write(result)
+        return write_only
+
+    def decoder(self, op_code):
+        c = self.c
+        name, first, seconds = self.firsts[op_code]
+
+        def handler():
+            pc = c.pc - 1
+            first()
+            if pc not in self.decoded:
+                self.decoded.add(pc)
+                if c.pc < len(c.mem) and c.mem[c.pc] in seconds:
+                    self.fused[pc] = self.fuse(pc, c.pc)
+        return handler
+
+    def fuse(self, pc, second_pc):
+        c, mem = self.c, self.c.mem
+        op_code, second_op_code = mem[pc], mem[second_pc]
+        name, first, seconds = self.firsts[op_code]
+        second = self.table[second_op_code]
+
+        def handler():
+            if mem[pc] != op_code or mem[second_pc] != second_op_code:
+                self.forget(pc, pc + 1)
+                return
+
+            c.pc = pc + 1
+            c.cycles += cycle_table[op_code]
+            first()
+            if c.cycles < self.until:
+                c.pc += 1
+                c.cycles += cycle_table[second_op_code]
+                self.fusions[name] += 1
+                second()
+        return handler
+
+    def forget(self, start, end):
+        if self.fused is None:
+            return
+        for pc in range(max(0, start - 5), end):
+            self.decoded.discard(pc)
+            self.fused.pop(pc, None)
+
+    def report(self):
+        return '\n'.join('%-16s %d' % (name, count) for name, count in self.fusions.items())
+
+    @classmethod
+    def takes_argument(cls, inst):
+        key = (cls, inst)
+        if key not in arguments:
+            arguments[key] = len(inspect.signature(getattr(cls, 'inst_' + inst)).parameters) == 2
+        return arguments[key]
 
-        if result is not None:
-            getattr(self.x, 'write_' + mode)(result)
+    @staticmethod
+    def illegal(op_code):
+        def handler():
+            raise Exception('Illegal op code %02x' % op_code)
+        return handler
 
     def inst_adc(self, arg):
-        result = self.c.a + arg + (1 if self.c.c else 0)
-        self.c.c = result > 0xff
-        self.c.a = self.x.result(result)
+        self.arithmetic(adc_table, arg)
 
     def inst_and(self, arg):
         self.c.a = self.c.a & arg
@@ -268,8 +621,13 @@ class Operations:
 
     def branch(self, condition):
         if condition:
-            self.c.pc += self.x.signed(self.x.read_im())
-        self.c.pc += 1
+            offset = self.x.signed(self.x.read_im())
+            self.c.cycles += 1 if (self.c.pc + offset) >> 8 == self.c.pc >> 8 else 2
+            self.c.pc += offset
+            if offset < 0:
+                self.c.loops.skip(self.c.pc, self.c.pc - offset)
+        else:
+            self.c.pc += 1
 
     def inst_bcc(self):
         self.branch(not self.c.c)
@@ -278,21 +636,20 @@ class Operations:
         self.branch(self.c.c)
 
     def inst_beq(self):
-        self.branch(self.c.z)
+        self.branch(not self.c.nz & 0xff)
 
     def inst_bit(self, arg):
-        self.c.z = (arg & self.c.a) == 0
-        self.c.n = (arg & 0x80) != 0
+        self.c.nz = nz_of(arg & 0x80, (arg & self.c.a) == 0)
         self.c.v = (arg & 0x40) != 0
 
     def inst_bmi(self):
-        self.branch(self.c.n)
+        self.branch(self.c.nz & 0x180)
 
     def inst_bne(self):
-        self.branch(not self.c.z)
+        self.branch(self.c.nz & 0xff)
 
     def inst_bpl(self):
-        self.branch(not self.c.n)
+        self.branch(not self.c.nz & 0x180)
 
     def inst_brk(self):
         pass
@@ -307,13 +664,13 @@ class Operations:
         self.c.c = False
 
     def inst_cld(self):
-        raise Exception('Not implemented')
+        self.c.d = False
 
     def inst_cli(self):
-        raise Exception('Not implemented')
+        self.c.i = False
 
     def inst_clv(self):
-        raise Exception('Not implemented')
+        self.c.v = False
 
     def inst_cmp(self, arg):
         self.c.z = self.c.a == arg
@@ -370,7 +727,7 @@ class Operations:
         self.c.a = self.c.a >> 1
 
     def inst_nop(self):
-        time.sleep(0.01)
+        pass
 
     def inst_ora(self):
         raise Exception('Not implemented')
@@ -379,13 +736,13 @@ class Operations:
         self.x.push(self.c.a)
 
     def inst_php(self):
-        raise Exception('Not implemented')
+        self.x.push(self.c.p | BREAK)
 
     def inst_pla(self):
         self.c.a = self.x.pull()
 
     def inst_plp(self):
-        raise Exception('Not implemented')
+        self.c.p = self.x.pull()
 
     def inst_rol(self):
         raise Exception('Not implemented')
@@ -394,26 +751,27 @@ class Operations:
         raise Exception('Not implemented')
 
     def inst_rti(self):
-        raise Exception('Not implemented')
+        self.c.p = self.x.pull()
+        self.c.pc = self.x.pull() + self.x.pull() * 0x100
 
     def inst_rts(self):
         self.c.pc = self.x.read_two_bytes(self.c.stack_top + self.c.sp + 1)
         self.x.pull()
         self.x.pull()
+        if self.c.on_return is not None:
+            self.c.on_return()
 
     def inst_sbc(self, arg):
-        result = self.c.a - arg - (0 if self.c.c else 1)
-        self.c.c = result >= 0
-        self.c.a = self.x.result(result)
+        self.arithmetic(sbc_table, arg)
 
     def inst_sec(self):
         self.c.c = True
 
     def inst_sed(self):
-        raise Exception('Not implemented')
+        self.c.d = True
 
     def inst_sei(self):
-        raise Exception('Not implemented')
+        self.c.i = True
 
     def inst_sta(self):
         return self.c.a
@@ -442,7 +800,10 @@ class Operations:
     def inst_tya(self):
         self.c.a = self.c.y
 
-    def adc(self, what):
-        result = self.c.a + what + (1 if self.c.c else 0)
-        self.c.c = result > 0xff
-        self.c.a = self.x.result(result)
\ No newline at end of file
+    def arithmetic(self, table, arg):
+        c = self.c
+        result = table[arg | c.a << 8 | c.c << 16 | c.d << 17]
+        c.a = result & 0xff
+        c.nz = result >> 8 & 0xff
+        c.c = result & 0x10000 != 0
+        c.v = result & 0x20000 != 0
\ No newline at end of file
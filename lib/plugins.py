@@ -1,24 +1,142 @@
-import threading
-import tkinter as tk
+import os
 import random
-import time
 
 
 class RandomNumberGenerator:
     def register(self, controller, address):
-        controller.vmem[address] = self
+        controller.map(self, address)
 
     def read(self, where):
         return random.randint(0, 0xff)
 
 
+class Timer:
+    def __init__(self, interval=None):
+        self.controller = None
+        self.address = 0
+        self.latch = interval or 0
+        self.control = 0
+        self.status = 0
+        self.expires = None
+        self.generation = 0
+
+    def register(self, controller, address):
+        self.controller = controller
+        self.address = address
+        controller.map(self, address, address + 4)
+        if self.latch:
+            self.start()
+
+    def start(self):
+        self.generation += 1
+        self.expires = None
+        if self.latch:
+            self.schedule(self.controller.cycles + self.latch)
+
+    def schedule(self, cycle):
+        generation = self.generation = self.generation + 1
+        self.expires = cycle
+        self.controller.scheduler.at(cycle, lambda: self.expire(generation))
+
+    def expire(self, generation):
+        if generation != self.generation:
+            return
+
+        self.status |= 0x80
+        if self.control & 0x01:
+            self.controller.irq()
+        if not self.latch:
+            self.expires = None
+            return
+        missed = max(0, self.controller.cycles - self.expires) // self.latch
+        self.schedule(self.expires + (missed + 1) * self.latch)
+
+    def read(self, where):
+        if self.expires is not None and self.controller.cycles >= self.expires:
+            self.expire(self.generation)
+
+        register = where - self.address
+        if register == 3:
+            status, self.status = self.status, 0
+            return status
+        if register == 2:
+            return self.control
+
+        remaining = 0 if self.expires is None else self.expires - self.controller.cycles
+        return remaining & 0xff if register == 0 else (remaining >> 8) & 0xff
+
+    def write(self, what, where):
+        register = where - self.address
+        if register == 0:
+            self.latch = (self.latch & 0xff00) | what
+        elif register == 1:
+            self.latch = (self.latch & 0x00ff) | what << 8
+            self.start()
+        elif register == 2:
+            self.control = what
+        else:
+            self.status = 0
+
+
+class SourceWatcher:
+    def __init__(self, path, assembler, every=None):
+        self.path = path
+        self.assembler = assembler
+        self.every = every
+        self.controller = None
+        self.modified = None
+        self.stack = 0xff
+        self.frame = None
+        self.returns = set()
+        self.patches = []
+
+    def register(self, controller):
+        self.controller = controller
+        self.modified = os.stat(self.path).st_mtime_ns
+        self.stack = controller.sp
+        controller.on_return = self.returned
+        controller.scheduler.every(self.every or controller.governor.frame, self.check, controller.cycles)
+
+    def check(self):
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if modified == self.modified:
+            return
+        self.modified = modified
+
+        try:
+            with open(self.path, 'r') as source:
+                self.patches += self.assembler.reassemble(source)
+        except Exception as e:
+            print('Not reloaded: %s' % e)
+            return
+
+        if self.controller.sp == self.stack:
+            self.apply()
+
+    def returned(self):
+        sp = self.controller.sp
+        if sp in self.returns and (self.frame is None or sp > self.frame):
+            self.frame = sp
+        self.returns.add(sp)
+
+        if self.patches and (sp == self.stack or self.frame is not None and sp >= self.frame):
+            self.apply()
+
+    def apply(self):
+        self.controller.patch(self.patches)
+        self.patches = []
+
+
 class Out:
     def __init__(self):
         self.buffer = []
-        threading.Thread(target=self.print).start()
 
-    def register(self, controller, where):
-        controller.vmem[where] = self
+    def register(self, controller, where, every=None):
+        controller.map(self, where)
+        controller.scheduler.every(every or controller.governor.frame, self.flush)
 
     def read(self, where):
         return 0
@@ -26,21 +144,43 @@ class Out:
     def write(self, what, where):
         self.buffer.insert(0, what)
 
-    def print(self):
-        while True:
-            while len(self.buffer) != 0:
-                print(self.buffer.pop())
-            time.sleep(0.01)
+    def flush(self):
+        while len(self.buffer) != 0:
+            print(self.buffer.pop())
+
+
+palette = [
+    (0x00, 0x00, 0x00),
+    (0xff, 0xff, 0xff),
+    (0x88, 0x00, 0x00),
+    (0xaa, 0xff, 0xee),
+    (0xcc, 0x44, 0xcc),
+    (0x00, 0xcc, 0x55),
+    (0x00, 0x00, 0xaa),
+    (0xee, 0xee, 0x77),
+    (0xdd, 0x88, 0x55),
+    (0x66, 0x44, 0x00),
+    (0xff, 0x77, 0x77),
+    (0x33, 0x33, 0x33),
+    (0x77, 0x77, 0x77),
+    (0xaa, 0xff, 0x66),
+    (0x00, 0x88, 0xff),
+    (0xbb, 0xbb, 0xbb)
+]
 
 
 class BitmapDisplay:
     def __init__(self, width, height, pixel_size=10):
+        import tkinter as tk
+
         self.start_address = 0
         self.flush_trigger = 0
         self.pixel_size = pixel_size
         self.width = width
         self.height = height
         self.last_key = 0
+        self.controller = None
+        self.irq = False
 
         self.top = tk.Tk()
         self.top.protocol("WM_DELETE_WINDOW", self.stop)
@@ -52,7 +192,6 @@ class BitmapDisplay:
 
         self.buffer = []
         self.running = True
-        self.thread = threading.Thread(target=self.update)
 
         self.colors = [
             "black",
@@ -73,16 +212,13 @@ class BitmapDisplay:
             "light gray"
         ]
 
-    def update(self):
-        while self.running:
-            self.flush()
-
     def flush(self):
         while self.running and len(self.buffer) != 0:
             what, where = self.buffer.pop()
             self.canvas.itemconfig(self.pixels[where], fill=self.colors[what % 0x10])
 
-        self.top.update()
+        if self.running:
+            self.top.update()
 
     def stop(self):
         self.running = False
@@ -90,17 +226,21 @@ class BitmapDisplay:
 
     def key_pressed(self, e):
         self.last_key = e.keycode
+        if self.irq:
+            self.controller.irq()
 
-    def register(self, controller, start_address, key_reader=None, flush_trigger=None):
+    def register(self, controller, start_address, key_reader=None, flush_trigger=None, irq=False):
+        self.controller = controller
         self.start_address = start_address
         self.flush_trigger = flush_trigger
+        self.irq = irq
 
-        for a in range(start_address, start_address + self.width * self.height):
-            controller.vmem[a] = self
+        controller.map(self, start_address, start_address + self.width * self.height)
         if key_reader is not None:
-            controller.vmem[key_reader] = self
+            controller.map(self, key_reader)
         if flush_trigger is not None:
-            controller.vmem[flush_trigger] = self
+            controller.map(self, flush_trigger)
+        controller.scheduler.every(controller.governor.frame, self.flush)
 
         for offset in range(0, self.width * self.height):
             x = offset % self.width
@@ -112,8 +252,6 @@ class BitmapDisplay:
                                                  fill='black', width=0)
             self.pixels[self.start_address + offset] = pixel
 
-        self.thread.start()
-
 
     def write(self, what, where):
         if not self.running:
@@ -129,4 +267,65 @@ class BitmapDisplay:
             self.top.update()
 
     def read(self, where):
-        return self.last_key
\ No newline at end of file
+        return self.last_key
+
+
+class HeadlessDisplay:
+    def __init__(self, width, height, directory=None, every=None):
+        self.start_address = 0
+        self.flush_trigger = 0
+        self.width = width
+        self.height = height
+        self.last_key = 0
+
+        self.directory = directory
+        self.every = every
+        self.frames = 0
+        self.controller = None
+        self.irq = False
+
+        self.pixels = bytearray(width * height)
+
+    def register(self, controller, start_address, key_reader=None, flush_trigger=None, irq=False):
+        self.controller = controller
+        self.start_address = start_address
+        self.flush_trigger = flush_trigger
+        self.irq = irq
+
+        controller.map(self, start_address, start_address + self.width * self.height)
+        if key_reader is not None:
+            controller.map(self, key_reader)
+        if flush_trigger is not None:
+            controller.map(self, flush_trigger)
+        if self.every is not None:
+            controller.scheduler.every(self.every, self.dump, controller.cycles)
+
+    def write(self, what, where):
+        if where == self.flush_trigger:
+            if self.every is None:
+                self.dump()
+        elif 0 <= where - self.start_address < len(self.pixels):
+            self.pixels[where - self.start_address] = what % 0x10
+
+    def read(self, where):
+        return self.last_key
+
+    def press(self, key, cycle):
+        self.controller.scheduler.at(cycle, lambda: self.key_pressed(key))
+
+    def key_pressed(self, key):
+        self.last_key = key
+        if self.irq:
+            self.controller.irq()
+
+    def ppm(self):
+        header = ('P6\n%d %d\n255\n' % (self.width, self.height)).encode()
+        return header + bytes(c for pixel in self.pixels for c in palette[pixel])
+
+    def dump(self):
+        self.frames += 1
+        if self.directory is None:
+            return
+
+        with open(os.path.join(self.directory, 'frame_%05d.ppm' % self.frames), 'wb') as f:
+            f.write(self.ppm())
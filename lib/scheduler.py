@@ -0,0 +1,28 @@
+import heapq
+import itertools
+
+
+class Scheduler:
+    def __init__(self, bound=None):
+        self.bound = bound
+        self.events = []
+        self.order = itertools.count()
+        self.next = float('inf')
+
+    def at(self, cycle, callback, period=None):
+        heapq.heappush(self.events, (cycle, next(self.order), callback, period))
+        self.next = self.events[0][0]
+        if self.bound is not None:
+            self.bound(self.next)
+
+    def every(self, period, callback, start=0):
+        self.at(start + period, callback, period)
+
+    def run(self, cycles):
+        while self.events and self.events[0][0] <= cycles:
+            cycle, order, callback, period = heapq.heappop(self.events)
+            if period is not None:
+                missed = max(0, cycles - cycle) // period
+                heapq.heappush(self.events, (cycle + (missed + 1) * period, next(self.order), callback, period))
+            callback()
+        self.next = self.events[0][0] if self.events else float('inf')
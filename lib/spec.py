@@ -1,19 +1,40 @@
+import asyncio
+import functools
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
+from lib import batch, cache, linker, ops, plugins, scheduler
 from lib.controller import Controller
 from lib.assembler import Assembler
+from lib.fused import FusedOperations
+from lib.linker import Linker
+from lib.translator import Translator
+
+try:
+    from lib import lockstep
+except ImportError:
+    lockstep = None
 
 
 class ControllerTest(unittest.TestCase):
     def test_load_memory(self):
         c = Controller(4, 0)
         c.load([42, 27], 1)
-        self.assertEqual(c.mem, [0, 42, 27, 0])
+        self.assertEqual(list(c.mem), [0, 42, 27, 0])
+
+    def test_load_bytes(self):
+        c = Controller(4, 0)
+        c.load(b'\x2a\x1b', 2)
+        self.assertEqual(bytes(c.memory), b'\x00\x00\x2a\x1b')
+        self.assertRaises(IndexError, c.load, b'\x2a\x1b', 3)
 
     def test_load_then_store(self):
         c = Controller(11, 2)
         c.run([0xa9, 42, 0x8d, 0x00, 0x00, 0x8d, 0x01, 0x00, 0x00])
         self.assertEqual(42, c.a)
-        self.assertEqual(c.mem[0:2], [42, 42])
+        self.assertEqual(list(c.mem[0:2]), [42, 42])
 
     def test_capture_writes(self):
         class Listener:
@@ -27,13 +48,166 @@ class ControllerTest(unittest.TestCase):
         listener = Listener()
 
         c = Controller(5, 2)
-        c.vmem[0x0200] = listener
+        c.map(listener, 0x0200)
         c.a = 42
         c.run([0x8d, 0x00, 0x02])
 
         self.assertEqual(0x0200, listener.where)
         self.assertEqual(42, listener.what)
 
+    def test_governor_paces_to_clock_rate(self):
+        program = Assembler().assemble('LDA #$0a STA $00 outer: LDX #$ff inner: DEX BNE inner DEC $00 BNE outer', 0x10)
+
+        c = Controller(0x40, 0x10, clock=100000)
+        start = time.perf_counter()
+        c.run(program)
+
+        self.assertGreater(c.cycles, 12000)
+        self.assertGreater(time.perf_counter() - start, 0.1)
+
+    def test_run_async_yields_between_slices(self):
+        program = Assembler().assemble('LDA #$0a STA $00 outer: LDX #$ff inner: DEX BNE inner DEC $00 BNE outer', 0x10)
+        c = Controller(0x40, 0x10)
+        c.loops.enabled = False
+        slices = []
+
+        async def count():
+            while True:
+                slices.append(c.cycles)
+                await asyncio.sleep(0)
+
+        async def main():
+            counter = asyncio.create_task(count())
+            await c.run_async(program, budget=500)
+            counter.cancel()
+
+        asyncio.run(main())
+        self.assertGreater(c.cycles, 12000)
+        self.assertGreater(len(slices), 12000 // 500)
+
+    def interrupted(self, program, handler, interrupts):
+        c = Controller()
+        c.loops.enabled = False
+        c.load(Assembler().assemble(handler, 0x0700), 0x0700)
+        c.load([0x00, 0x07, 0x00, 0x07], 0xfffa)
+        c.load([0x00, 0x07], 0xfffe)
+        for cycle, line in interrupts:
+            c.scheduler.at(cycle, getattr(c, line))
+        c.run(Assembler().assemble(program))
+        return c
+
+    def test_irq(self):
+        c = self.interrupted('LDA #$07 LDX #$00 CLI wait: CPX #$01 BNE wait STA $00', 'INX RTI', [(100, 'irq')])
+        self.assertEqual(c.x, 1)
+        self.assertEqual(c.mem[0], 7)
+        self.assertEqual(c.sp, 0xff)
+        self.assertEqual(c.i, False)
+
+    def test_irq_is_masked(self):
+        c = self.interrupted('LDX #$00 SEI wait: DEC $00 BNE wait STX $01', 'INX RTI', [(100, 'irq')])
+        self.assertEqual(c.x, 0)
+        self.assertTrue(c.pending_irq)
+
+    def test_take_irq_right_after_cli(self):
+        c = self.interrupted('SEI LDX #$00 wait: INX CPX #$40 BNE wait CLI LDA #$01 LDA #$02 LDA #$03',
+                             'RTI', [(10, 'irq')])
+        self.assertFalse(c.pending_irq)
+        self.assertEqual(c.mem[0x1fe] + c.mem[0x1ff] * 0x100, 0x0609)
+
+    def test_restore_pending_interrupts(self):
+        c = Controller()
+        snapshot = c.snapshot()
+        c.irq()
+        c.nmi()
+        c.restore(snapshot)
+        self.assertEqual([c.pending_irq, c.pending_nmi], [False, False])
+
+        c.irq()
+        snapshot = c.snapshot()
+        c.pending_irq = False
+        c.restore(snapshot)
+        self.assertTrue(c.pending_irq)
+
+    def test_nmi_ignores_mask(self):
+        c = self.interrupted('LDX #$00 SEI wait: CPX #$01 BNE wait', 'INX RTI', [(100, 'nmi')])
+        self.assertEqual(c.x, 1)
+        self.assertEqual(c.i, True)
+
+    def test_map_address_ranges(self):
+        class Device:
+            def read(self, where):
+                return 0xff
+
+        c = Controller(0x400, 0)
+        c.map(Device(), 0x0100, 0x0300)
+        c.map(Device(), 0x03fe)
+        c.mem[0x03fd] = 27
+
+        self.assertEqual(c.mem_read(0x00ff), 0)
+        self.assertEqual(c.mem_read(0x0100), 0xff)
+        self.assertEqual(c.mem_read(0x02ff), 0xff)
+        self.assertEqual(c.mem_read(0x03fd), 27)
+        self.assertEqual(c.mem_read(0x03fe), 0xff)
+        self.assertIsNone(c.readers[0x00])
+        self.assertIsNone(c.device(0x03ff))
+
+    def test_map_address_into_mapped_page(self):
+        class Device:
+            def __init__(self):
+                self.written = []
+
+            def read(self, where):
+                return 0xff
+
+            def write(self, what, where):
+                self.written.append((what, where))
+
+        c = Controller(0x400, 0)
+        a, b = Device(), Device()
+        c.map(a, 0x0200, 0x0300)
+        c.map(b, 0x02f0)
+        c.mem_write(5, 0x0210)
+        c.mem_write(6, 0x02f0)
+
+        self.assertEqual(a.written, [(5, 0x0210)])
+        self.assertEqual(b.written, [(6, 0x02f0)])
+        self.assertEqual(c.mem[0x0210], 0)
+        self.assertIs(c.device(0x02ff), a)
+
+    def test_snapshot_and_restore(self):
+        c = Controller(0x300, 0x200)
+        c.load(Assembler().assemble('LDA #$2a STA $00 LDX #$01 STX $0100 SEC', 0x200), 0x200)
+
+        before = c.snapshot()
+        c.run()
+        after = c.snapshot()
+        self.assertIs(after.pages[2], before.pages[2])
+        self.assertIsNot(after.pages[0], before.pages[0])
+
+        c.restore(before)
+        self.assertEqual([c.pc, c.a, c.x, c.c, c.cycles], [0x200, 0, 0, False, 0])
+        self.assertEqual([c.mem[0x00], c.mem[0x100]], [0, 0])
+
+        c.restore(after)
+        self.assertEqual([c.a, c.x, c.c, c.cycles], [42, 1, True, 13])
+        self.assertEqual([c.mem[0x00], c.mem[0x100]], [42, 1])
+
+
+    def test_map_after_snapshot(self):
+        class Device:
+            def read(self, where):
+                return 0
+
+            def write(self, what, where):
+                pass
+
+        c = Controller(0x600, 0)
+        snapshot = c.snapshot()
+        c.map(Device(), 0x0500)
+        c.mem_write(9, 0x0501)
+        c.restore(snapshot)
+        self.assertEqual(c.mem[0x0501], 0)
+
 
 class OperationsTest(unittest.TestCase):
     def x(self, program, data=0, stack=0):
@@ -49,7 +223,7 @@ class OperationsTest(unittest.TestCase):
 
     def test_sta_ab(self):
         c = self.x('LDA #$1b STA $0002', 3)
-        self.assertEqual(c.mem[0:3], [0, 0, 27])
+        self.assertEqual(list(c.mem[0:3]), [0, 0, 27])
 
     def test_tax(self):
         c = self.x('LDA #$1c TAX')
@@ -66,25 +240,25 @@ class OperationsTest(unittest.TestCase):
 
     def test_bne_back(self):
         c = self.x('LDX #$08 decrement: DEX STX $0000 CPX #$03 BNE decrement STX $0001 BRK', 2)
-        self.assertEqual(c.mem[2:],
+        self.assertEqual(list(c.mem[2:]),
                          [0xa2, 0x08, 0xca, 0x8e, 0x00, 0x00, 0xe0, 0x03, 0xd0, 0xf8, 0x8e, 0x01, 0x00, 0x00])
         self.assertEqual(c.x, 3)
-        self.assertEqual(c.mem[:2], [3, 3])
+        self.assertEqual(list(c.mem[:2]), [3, 3])
 
     def test_bne_forward(self):
         c = self.x('LDA #$01 CMP #$02 BNE notequal STA $01 notequal: TAX', 2)
-        self.assertEqual(c.mem[0:2], [0, 0])
-        self.assertEqual(c.mem[2:], [0xa9, 0x01, 0xc9, 0x02, 0xd0, 0x02, 0x85, 0x01, 0xaa])
+        self.assertEqual(list(c.mem[0:2]), [0, 0])
+        self.assertEqual(list(c.mem[2:]), [0xa9, 0x01, 0xc9, 0x02, 0xd0, 0x02, 0x85, 0x01, 0xaa])
         self.assertEqual(c.a, 1)
         self.assertEqual(c.x, 1)
 
     def test_addressing_zero_page(self):
         c = self.x('LDA #$1b STA $01', 2)
-        self.assertEqual(c.mem[0:2], [0, 27])
+        self.assertEqual(list(c.mem[0:2]), [0, 27])
 
     def test_addressing_zero_page_x(self):
         c = self.x('LDX #$01 LDA #$1b STA $01,X INX STA $01,X DEX STA $ff,X', 4)
-        self.assertEqual(c.mem[0:4], [0, 27, 27, 27])
+        self.assertEqual(list(c.mem[0:4]), [0, 27, 27, 27])
 
     def test_addressing_absolute(self):
         c = self.x('LDX #$01 STX $01ff', 0x200)
@@ -92,30 +266,30 @@ class OperationsTest(unittest.TestCase):
 
     def test_absolute_x_and_y(self):
         c = self.x('LDX #$01 LDY #$02 LDA #$1b STA $0001,X STA $0001,Y', 4)
-        self.assertEqual(c.mem[0:4], [0, 0, 27, 27])
+        self.assertEqual(list(c.mem[0:4]), [0, 0, 27, 27])
 
     def test_indexed_indirect(self):
         c = self.x('LDX #$01 LDA #$01 STA $02 LDA #$00 STA $03 LDA #$1b STA ($01,X)', 4)
-        self.assertEqual(c.mem[0:4], [0, 27, 0x01, 0x00])
+        self.assertEqual(list(c.mem[0:4]), [0, 27, 0x01, 0x00])
 
     def test_indirect_indexed(self):
         c = self.x('LDY #$01 LDA #$01 STA $03 LDA #$00 STA $04 LDA #$1b STA ($03),Y', 5)
-        self.assertEqual(c.mem[0:5], [0, 0, 27, 0x01, 0x00])
+        self.assertEqual(list(c.mem[0:5]), [0, 0, 27, 0x01, 0x00])
 
     def test_jmp(self):
         c = self.x('LDA #$1b JMP there STA $00 there: STA $01', 2)
-        self.assertEqual(c.mem[0:2], [0, 27])
+        self.assertEqual(list(c.mem[0:2]), [0, 27])
 
     def test_stack(self):
         c = self.x('LDA #$01 PHA LDA #$02 PHA LDA #$00 PLA TAX PLA PHA', 0, 3)
-        self.assertEqual(c.mem[3:], [0xa9, 0x01, 0x48, 0xa9, 0x02, 0x48, 0xa9, 0x00, 0x68, 0xaa, 0x68, 0x48])
+        self.assertEqual(list(c.mem[3:]), [0xa9, 0x01, 0x48, 0xa9, 0x02, 0x48, 0xa9, 0x00, 0x68, 0xaa, 0x68, 0x48])
         self.assertEqual(c.a, 1)
         self.assertEqual(c.x, 2)
         self.assertEqual(c.sp, 0x01)
 
     def test_subroutine(self):
         c = self.x('JSR there INX BRK there: LDX #$01 RTS', 0, 2)
-        self.assertEqual(c.mem[2:], [0x20, 0x07, 0x00, 0xe8, 0x00, 0xa2, 0x01, 0x60])
+        self.assertEqual(list(c.mem[2:]), [0x20, 0x07, 0x00, 0xe8, 0x00, 0xa2, 0x01, 0x60])
         self.assertEqual(c.x, 2)
 
     def test_comments(self):
@@ -136,6 +310,631 @@ class OperationsTest(unittest.TestCase):
         c = self.x('LDA #27 STA $00 INC $00', 1)
         self.assertEqual(c.mem[0], 28)
 
+    def test_indexed_reads(self):
+        c = self.x('LDA #$1b STA $02 LDX #$01 LDY #$02 LDA $0001,X TAX LDA $0000,Y', 3)
+        self.assertEqual(c.x, 27)
+        self.assertEqual(c.a, 27)
+
+    def test_cycles(self):
+        c = self.x('LDX #$03 loop: DEX BNE loop')
+        self.assertEqual(c.cycles, 2 + 3 * 2 + 2 * 3 + 2)
+
+    def test_cycles_page_crossing(self):
+        c = self.x('LDX #$01 LDA $00ff,X LDA $0001,X STA $00ff,X', 0x200)
+        self.assertEqual(c.cycles, 2 + 5 + 4 + 5)
+
+    def test_illegal_op_code(self):
+        c = Controller(2, 0)
+        self.assertRaises(Exception, c.run, [0x02])
+
+    def test_flags(self):
+        c = self.x('LDX #$81 DEX')
+        self.assertEqual(c.n, True)
+        self.assertEqual(c.z, False)
+        c.z = True
+        self.assertEqual(c.n, True)
+        self.assertEqual(c.z, True)
+        c.n = False
+        self.assertEqual(c.n, False)
+        self.assertEqual(c.z, True)
+
+    def test_bmi(self):
+        c = self.x('LDX #$81 DEX BMI negative INX negative: BRK')
+        self.assertEqual(c.x, 0x80)
+
+    def test_php_plp(self):
+        c = self.x('SEC LDX #$01 DEX PHP CLC INX PLP', 0, 2)
+        self.assertEqual(c.mem[1], 0x33)
+        self.assertEqual(c.z, True)
+        self.assertEqual(c.c, True)
+
+
+class FusionTest(unittest.TestCase):
+    def test_fused_pairs(self):
+        c = Controller(0x20, 0x10)
+        c.loops.enabled = False
+        c.run(Assembler().assemble('LDX #$04 loop: LDA #$01 STA $00 DEX BNE loop', 0x10))
+        self.assertEqual(c.mem[0], 1)
+        self.assertEqual(c.ops.fusions['dex bne'], 3)
+        self.assertEqual(c.ops.fusions['lda sta'], 3)
+        self.assertEqual(sorted(c.ops.fused), [0x12, 0x16])
+
+    def test_forget_fused_pairs_on_load(self):
+        c = Controller(0x20, 0x10)
+        c.loops.enabled = False
+        c.run(Assembler().assemble('LDX #$02 loop: DEX BNE loop', 0x10))
+        c.load(Assembler().assemble('LDX #$02 loop: DEX BEQ loop', 0x10), 0x10)
+        self.assertEqual(c.ops.fused, {})
+
+    def test_stop_between_fused_instructions(self):
+        c = Controller(0x20, 0x10)
+        c.loops.enabled = False
+        c.load(Assembler().assemble('LDX #$03 loop: DEX BNE loop', 0x10), 0x10)
+        c.pc = 0x10
+        c.ops.run(c.cycles + 7)
+        self.assertEqual((c.pc, c.ops.fusions['dex bne']), (0x12, 0))
+
+        c.ops.run(c.cycles + 1)
+        self.assertEqual((c.pc, c.x, c.ops.fusions['dex bne']), (0x13, 1, 0))
+
+    def test_rewritten_pair_is_not_fused(self):
+        c = Controller(0x20, 0x10)
+        c.loops.enabled = False
+        c.load(Assembler().assemble('LDX #$03 loop: DEX BNE loop', 0x10), 0x10)
+        c.pc = 0x10
+        c.ops.run(c.cycles + 7)
+        c.mem_write(0xe8, 0x12)
+        c.ops.run(c.cycles + 2)
+        self.assertEqual((c.pc, c.x), (0x13, 3))
+
+    def test_fusion_off(self):
+        c = Controller(0x20, 0x10, operations=functools.partial(ops.Operations, fusion=False))
+        c.run(Assembler().assemble('LDX #$03 loop: DEX BNE loop', 0x10))
+        self.assertEqual(c.x, 0)
+        self.assertEqual(c.ops.fusions, {})
+
+
+class AssemblerTest(unittest.TestCase):
+    def test_track_lines(self):
+        asm = Assembler()
+        dump = asm.assemble('\n  ; comment\nstart:\tLDA #$01 ; load\n\n  STA $02 ;;\nJMP start')
+
+        self.assertEqual(dump, [0xa9, 0x01, 0x85, 0x02, 0x4c, 0x00, 0x06])
+        self.assertEqual(asm.lines, {0x0600: 1, 0x0602: 3, 0x0604: 4})
+        self.assertEqual(asm.labels, {'start': 0x0600})
+
+    def test_assemble_iterable_of_lines(self):
+        source = '\n  ; comment\nstart:\tLDA #$01 ; load\n\n  STA $02 ;;\nJMP start'
+        lines = (line for line in source.split('\n'))
+
+        asm, streamed = Assembler(), Assembler()
+        dump = asm.assemble(source)
+        self.assertEqual(streamed.assemble(lines), dump)
+        self.assertEqual(streamed.lines, asm.lines)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'source.txt'), 'w') as f:
+                f.write(source)
+            with open(os.path.join(directory, 'source.txt')) as f:
+                self.assertEqual(Assembler().assemble(f), dump)
+
+    def test_reassemble_to_patches(self):
+        asm = Assembler()
+        asm.assemble('LDX #$03 loop: DEX BNE loop LDA #$01 STA $10')
+
+        self.assertEqual(asm.reassemble('LDX #$05 loop: DEX BNE loop LDA #$02 STA $10'),
+                         [(0x0601, b'\x05'), (0x0606, b'\x02')])
+        self.assertEqual(asm.reassemble('LDX #$05 loop: NOP DEX BNE loop LDA #$02'),
+                         [(0x0602, b'\xea\xca\xd0\xfc\xa9\x02\x00')])
+        self.assertEqual(asm.reassemble('LDX #$05 loop: NOP DEX BNE loop LDA #$02'), [])
+
+    def test_reparse_only_changed_lines(self):
+        asm = Assembler()
+        asm.assemble('start: LDA #$01\nSTA $00\nJMP start\nBRK')
+        with mock.patch.object(asm, 'parse_unit', side_effect=asm.parse_unit) as parse:
+            asm.reassemble('start: LDA #$01\nSTA $01\nJMP start\nBRK')
+        self.assertEqual([call.args[0].key for call in parse.call_args_list], [('STA $01',)])
+
+    def test_reassemble_shifted_code(self):
+        asm = Assembler()
+        previous = asm.assemble('start: LDX #$03\nloop: DEX\nBNE loop\nJMP end\nNOP\nend: BNE start\nBRK')
+
+        for program in ['start: LDX #$03\nloop: DEX\nNOP\nBNE loop\nJMP end\nNOP\nend: BNE start\nBRK',
+                        'start: LDX #$03\nloop: DEX\nNOP\nBNE loop\nJMP end\nend: BNE start\nBRK',
+                        'start: LDX #$03\n\nloop: DEX\nNOP\nBNE\nloop\nJMP end\nend: BNE start']:
+            fresh = Assembler()
+            dump = fresh.assemble(program)
+            patched = previous + [0] * (len(dump) - len(previous))
+            for address, data in asm.reassemble(program):
+                patched[address - 0x0600:address - 0x0600 + len(data)] = data
+
+            self.assertEqual(patched[:len(dump)], dump)
+            self.assertEqual((asm.labels, asm.lines), (fresh.labels, fresh.lines))
+            previous = dump
+
+    def test_recover_from_failed_reassembly(self):
+        asm = Assembler()
+        asm.assemble('start: LDA #$01\nJMP start')
+        with self.assertRaises(KeyError):
+            asm.reassemble('begin: LDA #$01\nJMP start')
+
+        self.assertEqual(asm.reassemble('start: LDA #$02\nJMP start'), [(0x0601, b'\x02')])
+
+    def test_patch_running_controller(self):
+        asm = Assembler()
+        c = Controller()
+        c.loops.enabled = False
+        c.load(asm.assemble('loop: LDA #$01 STA $00 JMP loop'), 0x0600)
+        c.ops.run(100)
+        c.patch(asm.reassemble('loop: LDA #$02 STA $00 JMP loop'))
+        c.ops.run(200)
+
+        self.assertEqual(c.mem[0], 0x02)
+
+    def test_report_line_of_error(self):
+        with self.assertRaisesRegex(Exception, r'Error in line 2 \[foo\]'):
+            Assembler().assemble('LDA #$01\n\nFOO $01')
+
+
+class LoopDetectorTest(unittest.TestCase):
+    def run_loop(self, program, enabled=True):
+        c = Controller(0x40, 0x10)
+        c.loops.enabled = enabled
+        c.run(Assembler().assemble(program, 0x10))
+        return c
+
+    def test_countdown(self):
+        program = 'LDX #$c8 loop: NOP DEX BNE loop STX $00'
+        fast = self.run_loop(program)
+        slow = self.run_loop(program, False)
+
+        self.assertIsNotNone(fast.loops.loops[(0x12, 0x16)][1])
+        self.assertEqual(fast.x, 0)
+        self.assertEqual((fast.pc, fast.cycles, fast.z, fast.n), (slow.pc, slow.cycles, slow.z, slow.n))
+
+    def test_count_up(self):
+        program = 'LDY #$f0 loop: INY BNE loop'
+        fast = self.run_loop(program)
+        slow = self.run_loop(program, False)
+
+        self.assertEqual(fast.y, 0)
+        self.assertEqual(fast.cycles, slow.cycles)
+
+    def test_ignores_loops_with_side_effects(self):
+        c = self.run_loop('LDX #$08 loop: STX $00 DEX BNE loop')
+        self.assertIsNone(c.loops.loops[(0x12, 0x17)][1])
+
+    def test_poll_device(self):
+        class Keyboard:
+            reads = 0
+
+            def read(self, where):
+                self.reads += 1
+                return 0x41 if self.reads > 3 else 0
+
+        keyboard = Keyboard()
+        c = Controller(0x40, 0x10)
+        c.map(keyboard, 0x3f)
+        c.run(Assembler().assemble('loop: LDA $3f CMP #$00 BEQ loop', 0x10))
+
+        self.assertEqual(c.a, 0x41)
+        self.assertEqual(keyboard.reads, 4)
+        self.assertGreater(c.cycles, 3 * c.governor.frame)
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_run_due_events_in_order(self):
+        s = scheduler.Scheduler()
+        events = []
+        s.at(20, lambda: events.append('second'))
+        s.at(10, lambda: events.append('first'))
+        s.every(15, lambda: events.append('tick'))
+
+        s.run(9)
+        self.assertEqual(events, [])
+        self.assertEqual(s.next, 10)
+
+        s.run(20)
+        self.assertEqual(events, ['first', 'tick', 'second'])
+        self.assertEqual(s.next, 30)
+
+    def test_skip_missed_periods(self):
+        s = scheduler.Scheduler()
+        events = []
+        s.every(10, lambda: events.append(1))
+        s.run(95)
+        self.assertEqual(events, [1])
+        self.assertEqual(s.next, 100)
+
+    def test_stop_run_loop_at_events(self):
+        program = Assembler().assemble('LDA #$0a STA $00 outer: LDX #$ff inner: DEX BNE inner DEC $00 BNE outer', 0x10)
+        c = Controller(0x40, 0x10)
+        c.loops.enabled = False
+        seen = []
+        c.scheduler.every(1000, lambda: seen.append(c.cycles))
+        c.run(program)
+
+        self.assertEqual(len(seen), c.cycles // 1000)
+        self.assertTrue(all(0 <= cycles - 1000 * (i + 1) < 8 for i, cycles in enumerate(seen)))
+
+
+class TimerTest(unittest.TestCase):
+    def test_snake_runs_without_timer(self):
+        with open(os.path.join(os.path.dirname(__file__), '..', 'samples', 'snake.txt')) as f:
+            program = Assembler().assemble(f)
+
+        c = Controller()
+        c.load(program, 0x0600)
+        self.assertFalse(c.ops.run(200000))
+
+    def test_set_status_bit_every_interval(self):
+        c = Controller(0x700)
+        plugins.Timer().register(c, 0xf8)
+        c.run(Assembler().assemble("""
+            LDA #$e8 STA $f8 LDA #$03 STA $f9
+            LDX #$00
+            wait: BIT $fb BPL wait INX CPX #$05 BNE wait"""))
+
+        self.assertEqual(c.x, 5)
+        self.assertGreaterEqual(c.cycles, 5000)
+        self.assertLess(c.cycles, 5030)
+
+    def test_stop_when_latch_is_cleared(self):
+        c = Controller(0x700)
+        timer = plugins.Timer()
+        timer.register(c, 0xf8)
+        c.run(Assembler().assemble('LDA #$e8 STA $f8 LDA #$00 STA $f9 STA $f8 LDX #$00 wait: DEX BNE wait'))
+
+        self.assertEqual(timer.latch, 0)
+        self.assertIsNone(timer.expires)
+        self.assertEqual(timer.status, 0x80)
+
+    def test_read_counter(self):
+        c = Controller(0x700)
+        timer = plugins.Timer(0x1000)
+        timer.register(c, 0xf8)
+        c.run(Assembler().assemble('LDA $f8 LDX $f9'))
+
+        self.assertEqual([c.a, c.x], [(0x1000 - 3) & 0xff, 0x0f])
+
+    def test_raise_irq(self):
+        c = Controller()
+        plugins.Timer(1000).register(c, 0xf8)
+        c.load(Assembler().assemble('INX RTI', 0x0700), 0x0700)
+        c.load([0x00, 0x07], 0xfffe)
+        c.run(Assembler().assemble('LDA #$01 STA $fa CLI wait: CPX #$03 BNE wait'))
+
+        self.assertEqual(c.x, 3)
+        self.assertGreaterEqual(c.cycles, 3000)
+
+
+class LinkerTest(unittest.TestCase):
+    main = 'LDX #$03 loop: JSR add DEX BNE loop JMP done'
+    library = 'add: CLC LDA $00 loop: ADC #$02 STA $00 RTS done: NOP'
+
+    def test_compile_relocatable_object(self):
+        obj = Assembler().compile(self.main)
+
+        self.assertEqual(obj.code, [0xa2, 0x03, 0x20, 0, 0, 0xca, 0xd0, 0xfa, 0x4c, 0, 0])
+        self.assertEqual(obj.labels, {'loop': 2})
+        self.assertEqual(obj.fixups, [(3, False, 'add'), (9, False, 'done')])
+
+    def test_link_modules_at_addresses(self):
+        linker = Linker()
+        linker.add(Assembler().compile(self.main), 0x0600)
+        linker.add(Assembler().compile(self.library), 0x0700)
+
+        c = Controller()
+        c.patch(linker.link())
+        c.run()
+
+        self.assertEqual(c.mem[0], 6)
+        self.assertEqual(linker.labels, {'add': 0x0700, 'done': 0x0708})
+        self.assertEqual(c.pc, 0x070a)
+
+    def test_report_undefined_and_ambiguous_labels(self):
+        linker = Linker()
+        linker.add(Assembler().compile(self.main), 0x0600)
+        with self.assertRaisesRegex(Exception, r'Undefined label \[add\]'):
+            linker.link()
+
+        linker.add(Assembler().compile(self.library), 0x0700)
+        linker.add(Assembler().compile(self.library), 0x0800)
+        with self.assertRaisesRegex(Exception, r'Label \[add\] is defined in more than one module'):
+            linker.link()
+
+    def test_reuse_cached_objects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = cache.CachedAssembler(directory).compile(self.main)
+            asm = cache.CachedAssembler(directory)
+            second = asm.compile(self.main)
+
+            self.assertTrue(asm.hit)
+            self.assertEqual(vars(second), vars(first))
+
+    def test_build_in_worker_processes(self):
+        segments = linker.build([(self.main, 0x0600), (self.library, 0x0700)], 2, cached=False)
+
+        self.assertEqual([address for address, code in segments], [0x0600, 0x0700])
+        self.assertEqual(segments[0][1][3:5], b'\x00\x07')
+
+
+class SourceWatcherTest(unittest.TestCase):
+    main = 'loop: JSR count JMP loop count: INC $00 LDA #$%02x STA $01 RTS'
+
+    def watch(self, directory):
+        path = os.path.join(directory, 'main.txt')
+        with open(path, 'w') as f:
+            f.write(self.main % 1)
+
+        asm = Assembler()
+        c = Controller()
+        c.loops.enabled = False
+        with open(path) as f:
+            c.load(asm.assemble(f), 0x0600)
+        watcher = plugins.SourceWatcher(path, asm, 100)
+        watcher.register(c)
+        return path, c, watcher
+
+    def edit(self, path, source):
+        with open(path, 'w') as f:
+            f.write(source)
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+
+    def run_until(self, c, cycles):
+        while c.ops.run(min(cycles, c.scheduler.next)) and c.cycles < cycles:
+            c.scheduler.run(c.cycles)
+
+    def test_patch_changed_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, c, watcher = self.watch(directory)
+            self.run_until(c, 1000)
+            self.edit(path, self.main % 2)
+            self.run_until(c, 2000)
+
+            self.assertEqual(c.mem[1], 2)
+            self.assertGreater(c.mem[0], 40)
+            self.assertEqual(watcher.patches, [])
+
+    def test_wait_for_main_loop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, c, watcher = self.watch(directory)
+            self.edit(path, self.main % 2)
+            c.pc, c.sp = 0x0606, 0xfd
+            c.mem[0x1fe:0x200] = b'\x03\x06'
+            watcher.check()
+
+            self.assertEqual(c.mem[0x0609], 1)
+            self.assertEqual(len(watcher.patches), 1)
+
+            self.run_until(c, 20)
+            self.assertEqual(c.mem[0x0609], 2)
+
+    def test_patch_main_loop_in_subroutine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.main = 'JSR init JSR loop init: RTS ' + self.main
+            path, c, watcher = self.watch(directory)
+            self.run_until(c, 1000)
+            self.edit(path, self.main % 2)
+            self.run_until(c, 2000)
+
+            self.assertEqual(watcher.frame, 0xfd)
+            self.assertEqual(c.mem[1], 2)
+            self.assertGreater(c.mem[0], 40)
+            self.assertEqual(watcher.patches, [])
+            self.assertLess(len(c.scheduler.events), 5)
+
+    def test_keep_running_on_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, c, watcher = self.watch(directory)
+            self.edit(path, 'loop: FOO $00')
+            with mock.patch('builtins.print') as printed:
+                self.run_until(c, 1000)
+
+            self.assertTrue(printed.call_args[0][0].startswith('Not reloaded'))
+            self.assertEqual(c.mem[1], 1)
+
+
+class HeadlessDisplayTest(unittest.TestCase):
+    def test_dump_frame_on_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            c = Controller(0x700)
+            plugins.HeadlessDisplay(2, 2, directory).register(c, 0x0200, 0xff, 0xf0)
+            c.run(Assembler().assemble('LDA #$01 STA $0201 LDA #$06 STA $0203 STA $f0'))
+
+            with open(os.path.join(directory, 'frame_00001.ppm'), 'rb') as f:
+                self.assertEqual(f.read(), b'P6\n2 2\n255\n' + bytes([0, 0, 0, 0xff, 0xff, 0xff, 0, 0, 0, 0, 0, 0xaa]))
+
+    def test_dump_every_n_cycles(self):
+        c = Controller(0x700)
+        display = plugins.HeadlessDisplay(2, 2, every=10)
+        display.register(c, 0x0200)
+        c.run(Assembler().assemble('LDA #$01 STA $0200 STA $0200 STA $0200 STA $0200 STA $0200'))
+
+        self.assertEqual(display.frames, 2)
+
+    def test_ignore_writes_outside_of_pixels(self):
+        c = Controller(0x700)
+        display = plugins.HeadlessDisplay(32, 24)
+        display.register(c, 0x0200, 0xff)
+        c.run(Assembler().assemble('LDA #$01 STA $ff'))
+
+        self.assertEqual(display.pixels, bytearray(32 * 24))
+
+    def test_deliver_key_at_cycle(self):
+        c = Controller(0x700)
+        display = plugins.HeadlessDisplay(2, 2)
+        display.register(c, 0x0200, 0xff)
+        display.press(0x41, 5000)
+        c.run(Assembler().assemble('wait: LDA $ff CMP #$00 BEQ wait STA $00'))
+
+        self.assertEqual(c.mem[0], 0x41)
+        self.assertGreaterEqual(c.cycles, 5000)
+        self.assertLess(c.cycles, 5030)
+
+    def test_key_raises_irq(self):
+        c = Controller()
+        display = plugins.HeadlessDisplay(2, 2)
+        display.register(c, 0x0200, 0xff, irq=True)
+        display.press(0x41, 5000)
+        c.load(Assembler().assemble('LDA $ff STA $00 BRK', 0x0700), 0x0700)
+        c.load([0x00, 0x07], 0xfffe)
+        c.run(Assembler().assemble('CLI wait: JMP wait'))
+
+        self.assertEqual(c.mem[0], 0x41)
+        self.assertEqual(list(c.mem[0x1fd:0x200]), [0x20, 0x01, 0x06])
+
+
+class BatchTest(unittest.TestCase):
+    def test_execute_job(self):
+        result = batch.execute(batch.Job('LDA #$2a STA $00 TAX', ranges=[(0x00, 0x02)]))
+        self.assertEqual(result.status, 'done')
+        self.assertEqual(result.registers['x'], 42)
+        self.assertEqual(result.memory, {(0x00, 0x02): b'\x2a\x00'})
+
+    def test_reuse_clean_controller(self):
+        batch.execute(batch.Job('LDA #$2a STA $00 TAX'))
+        result = batch.execute(batch.Job('LDY $00', ranges=[(0x00, 0x01)]))
+        self.assertEqual(result.registers['x'], 0)
+        self.assertEqual(result.registers['y'], 0)
+        self.assertEqual(result.memory[(0x00, 0x01)], b'\x00')
+
+    def test_limit_and_timeout(self):
+        self.assertEqual(batch.execute(batch.Job('loop: JMP loop', limit=1000)).status, 'limit')
+        self.assertEqual(batch.execute(batch.Job('loop: JMP loop', timeout=0.01)).status, 'timeout')
+        self.assertTrue(batch.execute(batch.Job('ROL A')).status.startswith('error'))
+
+    def test_cache_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': directory}):
+                batch.execute(batch.Job('LDX #$01'))
+                self.assertFalse(os.path.exists(os.path.join(directory, '6502')))
+
+                result = batch.execute(batch.Job('LDX #$01', cache=True))
+                self.assertEqual(result.registers['x'], 1)
+                self.assertEqual(len(os.listdir(os.path.join(directory, '6502'))), 1)
+
+    def test_run_batch_in_worker_processes(self):
+        results = batch.run_batch([batch.Job('LDX #$%02x' % i, str(i)) for i in range(4)], 2)
+        self.assertEqual([(r.name, r.registers['x']) for r in results], [('0', 0), ('1', 1), ('2', 2), ('3', 3)])
+
+
+class CacheTest(unittest.TestCase):
+    program = 'start: LDX #$03 loop: DEX\nBNE loop JMP start'
+
+    def test_reuse_assembled_program(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = cache.CachedAssembler(directory)
+            dump = first.assemble(self.program, 0x0700)
+            second = cache.CachedAssembler(directory)
+
+            self.assertEqual(second.assemble(self.program, 0x0700), dump)
+            self.assertEqual([first.hit, second.hit], [False, True])
+            self.assertEqual(second.labels, {'start': 0x0700, 'loop': 0x0702})
+            self.assertEqual(second.lines, first.lines)
+
+    def test_share_entries_between_text_and_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            streamed = cache.CachedAssembler(directory)
+            dump = streamed.assemble(line + '\n' for line in self.program.split('\n'))
+            text = cache.CachedAssembler(directory)
+            text.assemble(self.program)
+
+            path = os.path.join(directory, 'source.txt')
+            with open(path, 'w') as f:
+                f.write(self.program)
+            seekable = cache.CachedAssembler(directory)
+            with open(path) as f:
+                self.assertEqual(seekable.assemble(f), dump)
+
+            self.assertEqual([streamed.hit, text.hit, seekable.hit], [False, True, True])
+            self.assertEqual(dump, Assembler().assemble(self.program))
+
+    def test_stream_lines_while_hashing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asm = cache.CachedAssembler(directory)
+            assembled = []
+
+            def lines():
+                for line in self.program.split('\n'):
+                    assembled.append(len(asm.texts))
+                    yield line
+
+            asm.assemble(lines())
+            self.assertEqual(assembled, [0, 1])
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_key_by_source_and_start_address(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache.CachedAssembler(directory).assemble(self.program)
+            other_start = cache.CachedAssembler(directory)
+            other_start.assemble(self.program, 0x0700)
+            other_source = cache.CachedAssembler(directory)
+            other_source.assemble(self.program + ' NOP')
+
+            self.assertFalse(other_start.hit)
+            self.assertFalse(other_source.hit)
+
+    def test_evict_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(3):
+                cache.CachedAssembler(directory).assemble('LDX #$%02x' % i)
+                time.sleep(0.01)
+            cache.CachedAssembler(directory).assemble('LDX #$00')
+            time.sleep(0.01)
+
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            asm = cache.CachedAssembler(directory, size)
+            asm.assemble('LDX #$03')
+
+            kept = [os.path.exists(os.path.join(directory, asm.key('LDX #$%02x' % i, 0x0600) + '.bin'))
+                    for i in range(4)]
+            self.assertEqual(kept, [True, False, True, True])
+
+
+@unittest.skipUnless(lockstep, 'numpy is not installed')
+class LockstepTest(unittest.TestCase):
+    program = Assembler().assemble("""
+        LDX $10
+        loop: ADC $11 DEX BNE loop
+        STA $00 PHP PLA STA $01
+        BIT $12 BMI negative LDA #$01 JMP end
+        negative: JSR subtract
+        end: STA $02 LDY #$03 LDA ($13),Y STA $03 BRK
+        subtract: LDA #$02 SED SBC $11 RTS""")
+
+    def test_lanes_match_controller(self):
+        lanes = [([1 + i * 17 % 0xff, i * 41 % 0x100, i * 73 % 0x100, 0x20 + i, 0x02], i * 29 % 0x100, i % 2, i % 3 == 0)
+                 for i in range(16)]
+
+        machines = lockstep.Lockstep(len(lanes), 0x700)
+        machines.load(self.program, 0x600)
+        for lane, (data, a, carry, decimal) in enumerate(lanes):
+            machines.mem[lane, 0x10:0x15] = data
+            machines.a[lane], machines.c[lane], machines.d[lane] = a, carry, decimal
+        machines.run()
+
+        for lane, (data, a, carry, decimal) in enumerate(lanes):
+            c = Controller(0x700)
+            c.load(self.program, 0x600)
+            c.load(data, 0x10)
+            c.a, c.c, c.d = a, carry, decimal
+            c.run()
+
+            self.assertEqual([machines.pc[lane], machines.sp[lane], machines.a[lane], machines.x[lane],
+                              machines.y[lane], machines.p[lane], machines.cycles[lane]],
+                             [c.pc, c.sp, c.a, c.x, c.y, c.p, c.cycles])
+            self.assertEqual(bytes(machines.mem[lane]), bytes(c.mem))
+
+    def test_stop_failing_lanes(self):
+        machines = lockstep.Lockstep(2, 0x700)
+        machines.load(Assembler().assemble('LDA $10 CMP #$00 BEQ done ROL A done: LDX #$01'), 0x600)
+        machines.mem[1, 0x10] = 1
+        machines.run()
+
+        self.assertEqual(list(machines.x), [1, 0])
+        self.assertEqual(machines.errors, [None, 'Not implemented'])
+
 
 class Py65Test(unittest.TestCase):
 
@@ -200,7 +999,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_absolute_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_absolute_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
         mpu.a = 0x01
         # $0000 ADC $C000
@@ -230,13 +1029,13 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_absolute_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_absolute_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         # $0000 ADC $C000
-        mpu.run((0x6D, 0x00, 0xC0))
         mpu.mem[0xC000] = 0x40
+        mpu.run((0x6D, 0x00, 0xC0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -245,106 +1044,106 @@ class Py65Test(unittest.TestCase):
 
     # ADC Zero Page
 
-    def _test_adc_bcd_off_zp_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_zp_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0x00
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_zp_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_zp_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0x00
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_zp_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_zp_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0xFE
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_zp_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_zp_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0xFF
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_zp_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_zp_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0x01
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_zp_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_zp_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0xff
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_zp_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_zp_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0x01
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_zp_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_zp_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0xff
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_zp_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_zp_overflow_set_on_40_plus_40(self):
         mpu = Controller()
         mpu.a = 0x40
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         # $0000 ADC $00B0
-        mpu.run((0x65, 0xB0))
         mpu.mem[0x00B0] = 0x40
+        mpu.run((0x65, 0xB0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -353,7 +1152,7 @@ class Py65Test(unittest.TestCase):
 
     # ADC Immediate
 
-    def _test_adc_bcd_off_immediate_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_immediate_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0
         # $0000 ADC #$00
@@ -364,10 +1163,10 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_immediate_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_immediate_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC #$00
         mpu.run((0x69, 0x00))
 
@@ -376,7 +1175,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_immediate_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_immediate_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         # $0000 ADC #$FE
@@ -387,7 +1186,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_immediate_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_immediate_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         # $0000 ADC #$FF
@@ -398,47 +1197,47 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_immediate_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_immediate_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC #$01
-        self._write(mpu.mem, 0x000, (0x69, 0x01))
+        mpu.run((0x69, 0x01))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_immediate_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_immediate_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC #$FF
-        self._write(mpu.mem, 0x000, (0x69, 0xff))
+        mpu.run((0x69, 0xff))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_immediate_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_immediate_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         # $0000 ADC #$01
-        self._write(mpu.mem, 0x000, (0x69, 0x01))
+        mpu.run((0x69, 0x01))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_immediate_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_immediate_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         # $0000 ADC #$FF
-        self._write(mpu.mem, 0x000, (0x69, 0xff))
+        mpu.run((0x69, 0xff))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_immediate_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_immediate_overflow_set_on_40_plus_40(self):
         mpu = Controller()
         mpu.a = 0x40
         # $0000 ADC #$40
@@ -449,10 +1248,10 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(True, mpu.v)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_on_immediate_79_plus_00_carry_set(self):
+    def test_adc_bcd_on_immediate_79_plus_00_carry_set(self):
         mpu = Controller()
-        mpu.p |= mpu.DECIMAL
-        mpu.p |= mpu.CARRY
+        mpu.d = True
+        mpu.c = True
         mpu.a = 0x79
         # $0000 ADC #$00
         mpu.run((0x69, 0x00))
@@ -463,10 +1262,10 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertEqual(False, mpu.c)
 
-    def _test_adc_bcd_on_immediate_6f_plus_00_carry_set(self):
+    def test_adc_bcd_on_immediate_6f_plus_00_carry_set(self):
         mpu = Controller()
-        mpu.p |= mpu.DECIMAL
-        mpu.p |= mpu.CARRY
+        mpu.d = True
+        mpu.c = True
         mpu.a = 0x6f
         # $0000 ADC #$00
         mpu.run((0x69, 0x00))
@@ -477,19 +1276,20 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertEqual(False, mpu.c)
 
-    def _test_adc_bcd_on_immediate_9c_plus_9d(self):
+    def test_adc_bcd_on_immediate_9c_plus_9d(self):
         mpu = Controller()
-        mpu.p |= mpu.DECIMAL
-        mpu.p &= ~(mpu.CARRY)
+        mpu.d = True
+        mpu.c = False
         mpu.a = 0x9c
         # $0000 ADC #$9d
-        # $0002 ADC #$9d
         mpu.run((0x69, 0x9d))
-        self._write(mpu.mem, 0x0002, (0x69, 0x9d))
 
         self.assertEqual(0x9f, mpu.a)
         self.assertEqual(True, mpu.c)
 
+        # $0002 ADC #$9d
+        mpu.run((0x69, 0x9d))
+
         self.assertEqual(0x93, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.v)
@@ -498,111 +1298,111 @@ class Py65Test(unittest.TestCase):
 
     # ADC Absolute, X-Indexed
 
-    def _test_adc_bcd_off_abs_x_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_abs_x_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0x00
         mpu.x = 0x03
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0x00
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_abs_x_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_abs_x_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
         mpu.x = 0x03
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0x00
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_abs_x_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_abs_x_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0xFE
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_abs_x_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_abs_x_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         mpu.x = 0x03
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0xFF
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_abs_x_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_abs_x_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0x01
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_abs_x_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_abs_x_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0xff
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_abs_x_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_abs_x_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0x01
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_abs_x_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_abs_x_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0xff
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_abs_x_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_abs_x_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         mpu.x = 0x03
         # $0000 ADC $C000,X
-        mpu.run((0x7D, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.x] = 0x40
+        mpu.run((0x7D, 0x00, 0xC0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -611,111 +1411,111 @@ class Py65Test(unittest.TestCase):
 
     # ADC Absolute, Y-Indexed
 
-    def _test_adc_bcd_off_abs_y_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_abs_y_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0x00
         mpu.y = 0x03
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0x00
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_abs_y_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_abs_y_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
         mpu.y = 0x03
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0x00
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_abs_y_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_abs_y_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         mpu.y = 0x03
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0xFE
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_abs_y_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_abs_y_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         mpu.y = 0x03
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0xFF
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_abs_y_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_abs_y_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0x01
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_abs_y_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_abs_y_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0xFF
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_abs_y_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_abs_y_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0x01
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_abs_y_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_abs_y_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0xFF
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_abs_y_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_abs_y_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         mpu.y = 0x03
         # $0000 ADC $C000,Y
-        mpu.run((0x79, 0x00, 0xC0))
         mpu.mem[0xC000 + mpu.y] = 0x40
+        mpu.run((0x79, 0x00, 0xC0))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -724,115 +1524,115 @@ class Py65Test(unittest.TestCase):
 
     # ADC Zero Page, X-Indexed
 
-    def _test_adc_bcd_off_zp_x_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_zp_x_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0x00
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0x00
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_zp_x_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_zp_x_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
         mpu.x = 0x03
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0x00
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_zp_x_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_zp_x_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0xFE
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_zp_x_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_zp_x_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0xFF
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_zp_x_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_zp_x_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0x01
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_zp_x_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_zp_x_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0xFF
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_zp_x_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_zp_x_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0x01
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_zp_x_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_zp_x_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0xff
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_zp_x_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_zp_x_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         mpu.x = 0x03
         # $0000 ADC $0010,X
-        mpu.run((0x75, 0x10))
         mpu.mem[0x0010 + mpu.x] = 0x40
+        mpu.run((0x75, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -841,133 +1641,142 @@ class Py65Test(unittest.TestCase):
 
     # ADC Indirect, Indexed (X)
 
-    def _test_adc_bcd_off_ind_indexed_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_ind_indexed_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0x00
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0x00
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_ind_indexed_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_ind_indexed_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
         mpu.x = 0x03
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0x00
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_ind_indexed_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_ind_indexed_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0xFE
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_ind_indexed_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_ind_indexed_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0xFF
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_ind_indexed_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_ind_indexed_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0x01
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_ind_indexed_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_ind_indexed_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0xFF
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_ind_indexed_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_ind_indexed_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0x01
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_ind_indexed_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_ind_indexed_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0xFF
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_ind_indexed_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_ind_indexed_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         mpu.x = 0x03
         # $0000 ADC ($0010,X)
         # $0013 Vector to $ABCD
-        mpu.run((0x61, 0x10))
-        self._write(mpu.mem, 0x0013, (0xCD, 0xAB))
+        mpu.mem[0x0013] = 0xCD
+        mpu.mem[0x0014] = 0xAB
         mpu.mem[0xABCD] = 0x40
+        mpu.run((0x61, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -976,133 +1785,142 @@ class Py65Test(unittest.TestCase):
 
     # ADC Indexed, Indirect (Y)
 
-    def _test_adc_bcd_off_indexed_ind_carry_clear_in_accumulator_zeroes(self):
+    def test_adc_bcd_off_indexed_ind_carry_clear_in_accumulator_zeroes(self):
         mpu = Controller()
         mpu.a = 0x00
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0x00
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(True, mpu.z)
 
-    def _test_adc_bcd_off_indexed_ind_carry_set_in_accumulator_zero(self):
+    def test_adc_bcd_off_indexed_ind_carry_set_in_accumulator_zero(self):
         mpu = Controller()
         mpu.a = 0
         mpu.y = 0x03
-        mpu.p |= mpu.CARRY
+        mpu.c = True
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0x00
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
         self.assertNotEqual(True, mpu.c)
 
-    def _test_adc_bcd_off_indexed_ind_carry_clear_in_no_carry_clear_out(self):
+    def test_adc_bcd_off_indexed_ind_carry_clear_in_no_carry_clear_out(self):
         mpu = Controller()
         mpu.a = 0x01
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0xFE
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0xFF, mpu.a)
         self.assertEqual(True, mpu.n)
         self.assertEqual(False, mpu.c)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_indexed_ind_carry_clear_in_carry_set_out(self):
+    def test_adc_bcd_off_indexed_ind_carry_clear_in_carry_set_out(self):
         mpu = Controller()
         mpu.a = 0x02
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0xFF
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x01, mpu.a)
         self.assertEqual(True, mpu.c)
         self.assertEqual(False, mpu.n)
         self.assertEqual(False, mpu.z)
 
-    def _test_adc_bcd_off_indexed_ind_overflow_clr_no_carry_01_plus_01(self):
+    def test_adc_bcd_off_indexed_ind_overflow_clr_no_carry_01_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.y = 0x03
         # $0000 $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0x01
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x02, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_indexed_ind_overflow_clr_no_carry_01_plus_ff(self):
+    def test_adc_bcd_off_indexed_ind_overflow_clr_no_carry_01_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x01
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0xFF
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x00, mpu.a)
         self.assertEqual(False, mpu.v)
 
-    def _test_adc_bcd_off_indexed_ind_overflow_set_no_carry_7f_plus_01(self):
+    def test_adc_bcd_off_indexed_ind_overflow_set_no_carry_7f_plus_01(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x7f
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0x01
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_indexed_ind_overflow_set_no_carry_80_plus_ff(self):
+    def test_adc_bcd_off_indexed_ind_overflow_set_no_carry_80_plus_ff(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.CARRY)
+        mpu.c = False
         mpu.a = 0x80
         mpu.y = 0x03
         # $0000 $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0xFF
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x7f, mpu.a)
         self.assertEqual(True, mpu.v)
 
-    def _test_adc_bcd_off_indexed_ind_overflow_set_on_40_plus_40(self):
+    def test_adc_bcd_off_indexed_ind_overflow_set_on_40_plus_40(self):
         mpu = Controller()
-        mpu.p &= ~(mpu.OVERFLOW)
+        mpu.v = False
         mpu.a = 0x40
         mpu.y = 0x03
         # $0000 ADC ($0010),Y
         # $0010 Vector to $ABCD
-        mpu.run((0x71, 0x10))
-        self._write(mpu.mem, 0x0010, (0xCD, 0xAB))
+        mpu.mem[0x0010] = 0xCD
+        mpu.mem[0x0011] = 0xAB
         mpu.mem[0xABCD + mpu.y] = 0x40
+        mpu.run((0x71, 0x10))
 
         self.assertEqual(0x80, mpu.a)
         self.assertEqual(True, mpu.n)
@@ -4318,7 +5136,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertEqual(True, mpu.c)
 
-    def _test_sbc_bcd_on_immediate_9a_minus_00_carry_set(self):
+    def test_sbc_bcd_on_immediate_9a_minus_00_carry_set(self):
         mpu = Controller()
         mpu.d = True
         mpu.c = True
@@ -4332,7 +5150,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertEqual(True, mpu.c)
 
-    def _test_sbc_bcd_on_immediate_00_minus_01_carry_set(self):
+    def test_sbc_bcd_on_immediate_00_minus_01_carry_set(self):
         mpu = Controller()
         mpu.d = True
         mpu.v = True
@@ -4348,7 +5166,7 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(False, mpu.z)
         self.assertEqual(False, mpu.c)
 
-    def _test_sbc_bcd_on_immediate_20_minus_0a_carry_unset(self):
+    def test_sbc_bcd_on_immediate_20_minus_0a_carry_unset(self):
         mpu = Controller()
         mpu.d = True
         mpu.a = 0x20
@@ -5287,5 +6105,94 @@ class Py65Test(unittest.TestCase):
         self.assertEqual(True, mpu.z)
 
 
+fused_controller = functools.partial(Controller, operations=FusedOperations)
+
+
+@mock.patch('lib.spec.Controller', fused_controller)
+class FusedControllerTest(ControllerTest):
+    pass
+
+
+@mock.patch('lib.spec.Controller', fused_controller)
+class FusedOperationsTest(OperationsTest):
+    pass
+
+
+@mock.patch('lib.spec.Controller', fused_controller)
+class FusedPy65Test(Py65Test):
+    pass
+
+
+translated_controller = functools.partial(Controller, operations=Translator)
+
+
+@mock.patch('lib.spec.Controller', translated_controller)
+class TranslatedControllerTest(ControllerTest):
+    pass
+
+
+@mock.patch('lib.spec.Controller', translated_controller)
+class TranslatedOperationsTest(OperationsTest):
+    pass
+
+
+@mock.patch('lib.spec.Controller', translated_controller)
+class TranslatedPy65Test(Py65Test):
+    pass
+
+
+class TranslatorTest(unittest.TestCase):
+    def test_caches_blocks_by_start_address(self):
+        c = Controller(0x20, 0x10, operations=Translator)
+        c.loops.enabled = False
+        c.run(Assembler().assemble('LDX #$03 loop: DEX BNE loop STX $00', 0x10))
+        self.assertEqual(c.x, 0)
+        self.assertEqual(sorted(c.ops.blocks), [0x10, 0x12, 0x15])
+
+    def test_self_modifying_code(self):
+        c = Controller(0x20, 0x10, operations=Translator)
+        c.run(Assembler().assemble('LDX #$00 loop: LDA #$01 INX STX $13 CPX #$03 BNE loop', 0x10))
+        self.assertEqual(c.x, 3)
+        self.assertEqual(c.a, 2)
+
+    def test_restore_forgets_blocks(self):
+        c = Controller(0x20, 0x10, operations=Translator)
+        c.load(Assembler().assemble('LDX #$05', 0x10), 0x10)
+        snapshot = c.snapshot()
+        c.run()
+        c.mem_write(0x07, 0x11)
+        c.pc = 0x10
+        c.run()
+        self.assertEqual(c.x, 7)
+
+        c.restore(snapshot)
+        c.run()
+        self.assertEqual(c.x, 5)
+
+    def test_map_keeps_blocks_trapped(self):
+        class Device:
+            def read(self, where):
+                return 0
+
+            def write(self, what, where):
+                pass
+
+        c = Controller(0x20, 0x10, operations=Translator)
+        c.load(Assembler().assemble('LDX #$05', 0x10), 0x10)
+        c.run()
+        c.map(Device(), 0x1f)
+        c.mem_write(0x07, 0x11)
+        c.pc = 0x10
+        c.run()
+        self.assertEqual(c.x, 7)
+
+    def test_load_forgets_blocks(self):
+        c = Controller(operations=Translator)
+        c.run(Assembler().assemble('LDA #$01 STA $00'))
+        c.pc = 0x0600
+        c.run(Assembler().assemble('LDA #$02 STA $00'))
+        self.assertEqual(c.mem[0], 2)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,133 @@
+from lib import fused, ops
+
+terminators = ['jmp', 'jsr', 'rti', 'rts'] + list(fused.branches)
+unmasking = ['cli', 'plp']
+stores = list(fused.writing) + ['dec', 'inc']
+
+
+class Translator(fused.FusedOperations):
+    max_block = 64
+
+    def __init__(self, controller):
+        super().__init__(controller)
+        self.blocks = {}
+        self.ranges = {}
+        self.covers = {}
+        self.trapped = {}
+        self.namespace = {'c': controller, 'mem_read': controller.mem_read, 'mem_write': controller.mem_write,
+                          'skip': controller.loops.skip, 'nz_of': ops.nz_of,
+                          'adc_table': ops.adc_table, 'sbc_table': ops.sbc_table}
+
+    def run(self, until):
+        c = self.c
+        self.until = until
+        blocks = self.blocks
+        while c.cycles < self.until:
+            if c.pc >= len(c.mem):
+                return False
+            if c.mem[c.pc] == 0:
+                c.pc += 1
+                return False
+
+            block = blocks.get(c.pc)
+            if block is None:
+                block = self.translate(c.pc)
+            block()
+        return True
+
+    def translate(self, start):
+        decoded = self.decode(start)
+        if not decoded:
+            return self.step
+
+        end = decoded[-1][0] + 1 + ops.sizes[decoded[-1][2]]
+        remaining = sum(ops.cycles[(inst, mode)] for pc, inst, mode in decoded)
+
+        lines = ['def block_%04x():' % start, '    c.cycles += %d' % remaining]
+        for pc, inst, mode in decoded:
+            remaining -= ops.cycles[(inst, mode)]
+            lines += ['    ' + l for l in self.instruction(pc, inst, mode, start, end, remaining)]
+        if decoded[-1][1] not in terminators:
+            lines.append('    c.pc = 0x%04x' % end)
+
+        exec(compile('\n'.join(lines) + '\n', '<block %04x>' % start, 'exec'), self.namespace)
+        block = self.namespace.pop('block_%04x' % start)
+
+        self.blocks[start] = block
+        self.ranges[start] = range(start, end)
+        for address in range(start, end):
+            self.covers.setdefault(address, set()).add(start)
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            if page not in self.trapped:
+                self.trapped[page] = self.c.writers[page]
+                self.c.writers[page] = self
+        return block
+
+    def decode(self, pc):
+        mem = self.c.mem
+        decoded = []
+        while len(decoded) < self.max_block and pc < len(mem) and mem[pc] in ops.instructions:
+            inst, mode = ops.instructions[mem[pc]]
+            size = ops.sizes[mode]
+            if inst == 'brk' or not fused.implemented(inst, mode) or pc + size >= len(mem):
+                break
+            if any(self.c.device(a) is not None for a in range(pc, pc + size + 1)):
+                break
+
+            decoded.append((pc, inst, mode))
+            if inst in terminators or inst in unmasking:
+                break
+            pc += 1 + size
+        return decoded
+
+    def instruction(self, pc, inst, mode, start, end, remaining):
+        mem = self.c.mem
+        size = ops.sizes[mode]
+        next_pc = '0x%04x' % (pc + 1 + size)
+        lo = '0x%02x' % mem[pc + 1] if size > 0 else None
+        hi = '0x%02x' % mem[pc + 2] if size > 1 else None
+
+        if inst in fused.branches:
+            target = pc + 2 + ops.Addressing.signed(mem[pc + 1])
+            taken = '1' if target >> 8 == (pc + 2) >> 8 else '2'
+            skip = []
+            if target <= pc and self.c.loops.analyse(target, pc + 2)[1] is not None:
+                skip = ['skip(0x%04x, 0x%04x)' % (target, pc + 2)]
+            return ['c.pc = ' + next_pc] + fused.instruction(inst, mode, lo, hi, next_pc,
+                                                             ([], '0x%04x' % target, taken, skip))
+
+        lines = fused.instruction(inst, mode, lo, hi, next_pc, None)
+        if inst in stores:
+            lines += ['if 0x%04x <= address < 0x%04x:' % (start, end),
+                      '    c.cycles -= %d' % remaining,
+                      '    c.pc = ' + next_pc,
+                      '    return']
+        return lines
+
+    def step(self):
+        c = self.c
+        c.pc += 1
+        c.cycles += ops.cycle_table[c.mem[c.pc - 1]]
+        self.exec(c.mem[c.pc - 1])
+
+    def invalidate(self, start):
+        self.blocks.pop(start, None)
+        for address in self.ranges.pop(start, []):
+            starts = self.covers[address]
+            starts.discard(start)
+            if not starts:
+                del self.covers[address]
+
+    def forget(self, start, end):
+        for start in {s for address in range(start, end) for s in self.covers.get(address, [])}:
+            self.invalidate(start)
+
+    def write(self, what, where):
+        device = self.trapped[where >> 8]
+        if device is None:
+            self.c.mem[where] = what
+        else:
+            device.write(what, where)
+
+        for start in list(self.covers.get(where, [])):
+            self.invalidate(start)
@@ -1,16 +1,39 @@
-import sys
-from lib import assembler, plugins, controller, debugger
+import argparse
+from lib import assembler, cache, plugins, controller
 
-program = open(sys.argv[1], 'r').read()
+parser = argparse.ArgumentParser()
+parser.add_argument('source_file')
+parser.add_argument('debug', nargs='?', choices=['debug'])
+parser.add_argument('--clock', type=int, default=4000, help='emulated clock rate in Hz (default: 4000)')
+parser.add_argument('--turbo', action='store_true', help='run as fast as possible')
+parser.add_argument('--headless', action='store_true', help='run without a window')
+parser.add_argument('--frames', metavar='DIR', help='dump headless frames as PPM files into DIR')
+parser.add_argument('--every', type=int, metavar='CYCLES', help='dump a frame every CYCLES cycles instead of on flush')
+parser.add_argument('--no-cache', action='store_true', help='always reassemble instead of using the assembly cache')
+parser.add_argument('--watch', action='store_true', help='patch the running program whenever the source file changes')
+args = parser.parse_args()
 
-if len(sys.argv) > 2:
-    debugger.Debugger().debug(program)
+if args.debug:
+    from lib import debugger
+    debugger.Debugger().debug(open(args.source_file, 'r').read())
 
 else:
-    c = controller.Controller()
+    c = controller.Controller(clock=None if args.turbo else args.clock)
 
-    plugins.BitmapDisplay(32, 32, 10).register(c, 0x0200, 0xff, 0xf0)
+    if args.headless:
+        display = plugins.HeadlessDisplay(32, 32, args.frames, args.every)
+    else:
+        display = plugins.BitmapDisplay(32, 32, 10)
+    display.register(c, 0x0200, 0xff, 0xf0)
     plugins.RandomNumberGenerator().register(c, 0xfe)
-    plugins.Out().register(c, 0xfd)
+    plugins.Timer().register(c, 0xf8)
+    out = plugins.Out()
+    out.register(c, 0xfd)
 
-    c.run(assembler.Assembler().assemble(program))
\ No newline at end of file
+    asm = assembler.Assembler() if args.no_cache else cache.CachedAssembler()
+    with open(args.source_file, 'r') as source:
+        program = asm.assemble(source)
+    if args.watch:
+        plugins.SourceWatcher(args.source_file, asm).register(c)
+    c.run(program)
+    out.flush()